@@ -0,0 +1,81 @@
+"""
+Seed a local database with a synthetic ledger and time the watermark mode
+of update_balance with an increasing number of shard workers, which upsert
+the shards of every chunk in parallel.
+
+    SQLALCHEMY_DATABASE_URI=mysql+pymysql://root:pw@127.0.0.1/bench \
+        python -m benchmarks.balance_shards --rows 1000000 --workers 1,2,4,8
+"""
+import argparse
+import random
+from time import time
+
+from src import batch, db, update_balance
+from src.models import BalanceLog, UserBalance2, Watermark
+
+SEED_BATCH = 10000
+
+
+def seed(rows, users):
+    tables = [BalanceLog.__table__, UserBalance2.__table__,
+              Watermark.__table__]
+    db.Model.metadata.create_all(db.engine, tables=tables)
+    with db.engine.begin() as conn:
+        conn.execute('TRUNCATE TABLE balance_logs')
+    ts = 1546300800000000
+    for offset in range(0, rows, SEED_BATCH):
+        batch = [{
+            'user_id': random.randint(1, users),
+            'transaction_timestamp': ts + offset + i,
+            'balance': -random.randint(1, 10),
+            'transaction_type': 'VIEW'
+        } for i in range(min(SEED_BATCH, rows - offset))]
+        with db.engine.begin() as conn:
+            conn.execute(BalanceLog.__table__.insert(), batch)
+
+
+def reset():
+    with db.engine.begin() as conn:
+        conn.execute('TRUNCATE TABLE user_balance_2')
+        conn.execute('TRUNCATE TABLE job_watermarks')
+    db.engine.dispose()
+
+
+def total_balance():
+    with db.engine.connect() as conn:
+        return conn.execute(
+            'SELECT COALESCE(SUM(balance), 0) FROM user_balance_2').scalar()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--workers', default='1,2,4,8')
+    parser.add_argument('--no-seed', action='store_true')
+    args = parser.parse_args()
+
+    if not args.no_seed:
+        seed(args.rows, args.users)
+    with db.engine.connect() as conn:
+        expected = conn.execute(
+            'SELECT COALESCE(SUM(balance), 0) FROM balance_logs').scalar()
+
+    update_balance.UPDATE_BALANCE_MODE = 'watermark'
+    # a shard stopped by the time budget would leave the ledger half done
+    batch.BATCH_TIME_BUDGET = 86400
+    baseline = None
+    for workers in [int(w) for w in args.workers.split(',')]:
+        reset()
+        ts = time()
+        update_balance.execute(workers)
+        took = time() - ts
+        baseline = baseline or took
+        print('workers={:<3} took={:.2f}s rows/s={:.0f} speedup={:.2f} '
+              'consistent={}'.format(workers, took, args.rows / took,
+                                     baseline / took,
+                                     total_balance() == expected))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Measure how stream cleanup affects concurrent writers inserting into
+`streams`. Seeds expired rows, then reports insert latency percentiles of a
+writer thread while idle, during the chunked cleanup and during the legacy
+single unbounded DELETE.
+
+    SQLALCHEMY_DATABASE_URI=mysql+pymysql://root:pw@127.0.0.1/bench \
+        python -m benchmarks.clean_stream_writers --rows 1000000
+"""
+import argparse
+import threading
+from time import time, sleep
+from datetime import datetime, timedelta
+
+from src import db, clean_stream
+from src.models import Stream
+
+SEED_BATCH = 10000
+
+
+def seed(rows):
+    db.Model.metadata.create_all(db.engine, tables=[Stream.__table__])
+    expired = datetime.utcnow() - timedelta(hours=2)
+    for offset in range(0, rows, SEED_BATCH):
+        batch = [{
+            'source_id': 'seed-{}'.format(offset + i),
+            'user_id': 1,
+            'source_type': 'drive',
+            'created_date': expired
+        } for i in range(min(SEED_BATCH, rows - offset))]
+        with db.engine.begin() as conn:
+            conn.execute(Stream.__table__.insert(), batch)
+
+
+class Writer(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.latencies = []
+        self.running = True
+
+    def run(self):
+        while self.running:
+            ts = time()
+            with db.engine.begin() as conn:
+                conn.execute(Stream.__table__.insert(), {
+                    'source_id': 'writer',
+                    'user_id': 1,
+                    'source_type': 'drive',
+                    'result': 'https://example.com',
+                    'created_date': datetime.utcnow()
+                })
+            self.latencies.append(time() - ts)
+            sleep(0.01)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def measure(label, work, idle=5):
+    writer = Writer()
+    writer.start()
+    ts = time()
+    deleted = work() if work else sleep(idle)
+    took = time() - ts
+    writer.running = False
+    writer.join()
+    print('{:<10} took={:.2f}s deleted={} writer p50={:.1f}ms p99={:.1f}ms '
+          'max={:.1f}ms'.format(label, took, deleted,
+                                percentile(writer.latencies, 50) * 1000,
+                                percentile(writer.latencies, 99) * 1000,
+                                percentile(writer.latencies, 100) * 1000))
+
+
+def unbounded():
+    one_hour_ago = datetime.utcnow() - timedelta(hours=1)
+    deleted = db.session.query(Stream).filter(
+        Stream.created_date < one_hour_ago).filter_by(result=None).delete(
+        synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--budget', type=float, default=600)
+    args = parser.parse_args()
+
+    # the idle baseline writes into the same seeded table
+    seed(args.rows)
+    measure('idle', None)
+    measure('chunked', lambda: clean_stream.execute(
+        args.chunk_size, args.budget))
+    seed(args.rows)
+    measure('unbounded', unbounded)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Metadata lookups per second of update_drive_info against the local fake
+Drive server, which limits every api key to --key-rate requests per second,
+for a growing number of keys.
+
+    python -m benchmarks.drive_keys --streams 400 --keys 1,2,4,8
+"""
+import argparse
+from time import time
+
+from benchmarks.fake_drive import serve
+from src import drive_batch, key_pool, update_drive_info
+from src.key_pool import KeyPool, ApiKey
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--streams', type=int, default=400)
+    parser.add_argument('--keys', default='1,2,4,8')
+    parser.add_argument('--key-rate', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--batch-size', type=int, default=0)
+    args = parser.parse_args()
+
+    serve(args.port, args.latency, background=True, key_rate=args.key_rate)
+    base = 'http://127.0.0.1:{}'.format(args.port)
+    update_drive_info.GDRIVE_API_URL = base + '/drive/v3'
+    drive_batch.GDRIVE_BATCH_URL = base + '/batch/drive/v3'
+    update_drive_info.LOGGER.disabled = True
+    key_pool.GDRIVE_KEY_COOLDOWN = 1
+
+    drive_ids = ['file{}'.format(i) for i in range(args.streams)]
+    for keys in [int(k) for k in args.keys.split(',')]:
+        update_drive_info.GDRIVE_CONCURRENCY = keys * 4
+        # stay under the fixed one second windows of the fake server
+        pool = KeyPool([ApiKey(i, 'key{}'.format(i), args.key_rate * 0.9, 1)
+                        for i in range(keys)])
+        ts = time()
+        infos = update_drive_info.fetch_all(drive_ids, pool, args.batch_size)
+        took = time() - ts
+        failed = sum(1 for (_, error) in infos if error is not None)
+        print('keys={:<3} took={:.2f}s lookups/s={:.0f} failed={}'.format(
+            keys, took, len(drive_ids) / took, failed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Local stand-in for the Drive v3 files endpoint and its batch endpoint, to
+exercise update_drive_info without touching Google.
+
+    python -m benchmarks.fake_drive --port 8900 --latency 0.2
+    GDRIVE_API_URL=http://127.0.0.1:8900/drive/v3 \
+    GDRIVE_BATCH_URL=http://127.0.0.1:8900/batch/drive/v3 \
+        GDRIVE_BATCH_SIZE=100 python -m src.update_drive_info
+
+Ids starting with `missing` answer 404 and ids starting with `broken`
+answer a body without `size`. With --key-rate, every api key may only make
+that many requests per second and gets a 429 beyond it.
+"""
+import re
+import json
+import random
+import argparse
+import threading
+from time import time, sleep
+from collections import defaultdict
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+FILE_PATH_RE = re.compile(r'/drive/v3/files/([^/?]+)')
+RATE_LIMITED = {'error': {'code': 429, 'message': 'Rate Limit Exceeded',
+                          'errors': [{'reason': 'rateLimitExceeded'}]}}
+
+
+class KeyLimiter(object):
+    """Fixed one second windows of requests per api key"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.windows = defaultdict(lambda: [0, 0])
+
+    def allow(self, path):
+        if not self.rate:
+            return True
+        key = parse_qs(urlsplit(path).query).get('key', [''])[0]
+        with self.lock:
+            window = self.windows[key]
+            now = int(time())
+            if window[0] != now:
+                window[0], window[1] = now, 0
+            window[1] += 1
+            return window[1] <= self.rate
+
+
+def lookup(path):
+    """Return (status_code, body) for a files/{id} request path"""
+    match = FILE_PATH_RE.match(urlsplit(path).path)
+    if match is None:
+        return 400, {'error': {'code': 400, 'message': 'bad path'}}
+    drive_id = unquote(match.group(1))
+    if drive_id.startswith('missing'):
+        return 404, {'error': {'code': 404, 'message': 'File not found'}}
+    file = {'id': drive_id, 'name': '{}.mp4'.format(drive_id),
+            'mimeType': 'video/mp4'}
+    if not drive_id.startswith('broken'):
+        file['size'] = str(random.randint(1, 2 ** 30))
+    return 200, file
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0
+    limiter = KeyLimiter(0)
+
+    def send_body(self, status_code, body, content_type):
+        body = body.encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('content-type', content_type)
+        self.send_header('content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        sleep(self.latency)
+        if not self.limiter.allow(self.path):
+            return self.send_body(429, json.dumps(RATE_LIMITED),
+                                  'application/json')
+        (status_code, body) = lookup(self.path)
+        self.send_body(status_code, json.dumps(body), 'application/json')
+
+    def do_POST(self):
+        sleep(self.latency)
+        if not self.limiter.allow(self.path):
+            return self.send_body(429, json.dumps(RATE_LIMITED),
+                                  'application/json')
+        length = int(self.headers.get('content-length', 0))
+        body = self.rfile.read(length).decode('utf-8')
+        boundary = self.headers.get_param('boundary')
+        response_boundary = 'batch_fake_drive'
+        parts = []
+        for part in body.split('--' + boundary)[1:]:
+            if part.startswith('--'):
+                break
+            content_id = re.search(r'Content-ID:\s*<([^>]+)>', part).group(1)
+            request_line = re.search(r'^GET (\S+)', part, re.M).group(1)
+            (status_code, file) = lookup(request_line)
+            parts.append(
+                '--{}\r\nContent-Type: application/http\r\n'
+                'Content-ID: <response-{}>\r\n\r\n'
+                'HTTP/1.1 {} {}\r\n'
+                'Content-Type: application/json; charset=UTF-8\r\n\r\n'
+                '{}\r\n'.format(response_boundary, content_id, status_code,
+                                self.responses[status_code][0],
+                                json.dumps(file)))
+        parts.append('--{}--\r\n'.format(response_boundary))
+        self.send_body(200, ''.join(parts),
+                       'multipart/mixed; boundary={}'.format(
+                           response_boundary))
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port=8900, latency=0, background=False, key_rate=0):
+    Handler.latency = latency
+    Handler.limiter = KeyLimiter(key_rate)
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        server.serve_forever()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0.1)
+    parser.add_argument('--key-rate', type=int, default=0)
+    args = parser.parse_args()
+    serve(args.port, args.latency, key_rate=args.key_rate)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+"""
+Seed a local database with a synthetic ledger and stream table at a given
+scale, run the DB-bound jobs against it and write one JSON document with
+the wall time, rows/s, SQL statement count and peak RSS of every job, so
+runs before and after a change can be compared.
+
+    SQLALCHEMY_DATABASE_URI=mysql+pymysql://root:pw@127.0.0.1/bench \
+        python -m benchmarks.harness --scale 10M --skew 1.1 \
+        --stream-mix expired=0.6,fresh=0.2,resolved=0.2 \
+        --output results/after.json --compare results/before.json
+
+Every job runs in a freshly spawned interpreter, so its peak RSS and
+statement count are its own. clean_stream deletes the expired streams it
+measures; rerun with the stream seed (the default) to measure it again.
+"""
+import os
+import json
+import bisect
+import random
+import argparse
+import resource
+import itertools
+import subprocess
+import multiprocessing
+from time import time
+from datetime import datetime, timedelta
+
+SEED_BATCH = 10000
+SCALES = {'1M': 1000000, '10M': 10000000, '100M': 100000000}
+TRANSACTION_TYPES = ['VIEW', 'UPLOAD_PHOTO', 'EXPORT_DRIVE']
+STREAM_AGES = ('expired', 'fresh', 'resolved')
+JOBS = ('update_balance', 'report_rollup', 'report', 'clean_stream')
+
+# measure throughput, not the production pacing of the jobs
+JOB_ENV = {
+    'UPDATE_BALANCE_MODE': 'watermark',
+    'CLEAN_STREAM_SLEEP_RATIO': '0',
+    'CLEAN_STREAM_TIME_BUDGET': '86400',
+    # every job drains the whole seeded ledger, so rows/s is right
+    'BATCH_TIME_BUDGET': '86400',
+    # the seeded ledger ends now, and no transaction is left open
+    'WATERMARK_SETTLE_SECONDS': '0',
+}
+
+
+def user_sampler(users, skew):
+    """Return a function drawing user ids from a zipf-like distribution,
+    user 1 being the busiest. A skew of 0 is uniform.
+    """
+    if not skew:
+        return lambda: random.randint(1, users)
+    weights = itertools.accumulate(
+        1.0 / (rank ** skew) for rank in range(1, users + 1))
+    cumulative = list(weights)
+    total = cumulative[-1]
+    return lambda: bisect.bisect_left(cumulative,
+                                      random.random() * total) + 1
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        (age, _, share) = part.partition('=')
+        if age not in STREAM_AGES:
+            raise argparse.ArgumentTypeError(
+                'unknown stream age {}'.format(age))
+        mix[age] = float(share)
+    return mix
+
+
+def parse_scale(value):
+    return SCALES[value] if value in SCALES else int(value)
+
+
+"""
+Seeding
+"""
+
+
+def create_tables():
+    from src import db
+    db.Model.metadata.create_all(db.engine)
+
+
+def insert_batches(table, rows, make_row):
+    from src import db
+    for offset in range(0, rows, SEED_BATCH):
+        batch = [make_row(offset + i)
+                 for i in range(min(SEED_BATCH, rows - offset))]
+        with db.engine.begin() as conn:
+            conn.execute(table.insert(), batch)
+
+
+def seed_ledger(rows, users, skew, days):
+    from src import db
+    from src.models import BalanceLog
+    with db.engine.begin() as conn:
+        conn.execute('TRUNCATE TABLE balance_logs')
+    draw_user = user_sampler(users, skew)
+    now = int(time() * 1000000)
+    span = days * 86400 * 1000000
+
+    def make_row(i):
+        transaction_type = random.choice(TRANSACTION_TYPES)
+        return {
+            'user_id': draw_user(),
+            # ids and timestamps grow together, like the live ledger
+            'transaction_timestamp': now - span + span * i // rows,
+            'balance': -random.randint(1, 10),
+            'transaction_type': transaction_type,
+            'source_id': 'source-{}'.format(random.randint(1, 10000))
+        }
+    insert_batches(BalanceLog.__table__, rows, make_row)
+
+
+def seed_streams(rows, mix):
+    from src import db
+    from src.models import Stream
+    with db.engine.begin() as conn:
+        conn.execute('TRUNCATE TABLE streams')
+    now = datetime.utcnow()
+    ages = list(mix)
+    cumulative = list(itertools.accumulate(mix[age] for age in ages))
+
+    def make_row(i):
+        age = ages[bisect.bisect_left(
+            cumulative, random.random() * cumulative[-1])]
+        if age == 'fresh':
+            created = now - timedelta(minutes=random.randint(0, 59))
+        else:
+            created = now - timedelta(hours=random.randint(2, 24 * 30))
+        return {
+            'source_id': 'seed-{}'.format(i),
+            'user_id': random.randint(1, 1000),
+            'source_type': 'drive',
+            'result': '{}' if age == 'resolved' else None,
+            'created_date': created
+        }
+    insert_batches(Stream.__table__, rows, make_row)
+
+
+def reset(job):
+    """Drop what a previous run of the job left behind"""
+    from src import db
+    from src.models import Watermark
+    watermarks = Watermark.__table__
+    statements = {
+        'update_balance': [
+            'TRUNCATE TABLE user_balance_2',
+            watermarks.delete().where(
+                watermarks.c.name.like('update_balance%'))],
+        'report_rollup': [
+            'TRUNCATE TABLE report_earning_hourly',
+            watermarks.delete().where(
+                watermarks.c.name == 'report_rollup')],
+        'report': ['TRUNCATE TABLE report_earning',
+                   'TRUNCATE TABLE report_earning_users',
+                   'TRUNCATE TABLE report_earning_sources'],
+    }
+    with db.engine.begin() as conn:
+        for statement in statements.get(job, []):
+            conn.execute(statement)
+
+
+"""
+Measurement, inside the spawned job process
+"""
+
+
+def ledger_rows():
+    from src import db
+    with db.engine.connect() as conn:
+        return conn.execute('SELECT COUNT(*) FROM balance_logs').scalar()
+
+
+def run_job(job, days):
+    """Run the job's execute(), returning the rows it deleted if it says"""
+    if job == 'clean_stream':
+        from src import clean_stream
+        return clean_stream.execute()
+    elif job == 'update_balance':
+        from src import update_balance
+        update_balance.execute()
+    elif job == 'report_rollup':
+        from src import report_rollup
+        report_rollup.execute()
+    elif job == 'report':
+        from src import report
+        today = datetime.now().date()
+        report.execute_range(today - timedelta(days=days), today, 'ledger')
+    else:
+        raise ValueError('unknown job {}'.format(job))
+
+
+def measure(job, days, results):
+    for (name, value) in JOB_ENV.items():
+        os.environ.setdefault(name, value)
+    from sqlalchemy import event
+    from src import db
+
+    # every ledger job reads the whole seeded ledger
+    rows = None if job == 'clean_stream' else ledger_rows()
+    statements = [0]
+
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements[0] += 1
+
+    ts = time()
+    deleted = run_job(job, days)
+    took = time() - ts
+    rows = deleted if rows is None else rows
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    results.put({
+        'job': job,
+        'wall_seconds': round(took, 3),
+        'rows': rows,
+        'rows_per_second': round(rows / took, 1) if took else None,
+        'statements': statements[0],
+        'peak_rss_kb': peak
+    })
+
+
+def revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, path):
+    with open(path) as f:
+        before = {r['job']: r for r in json.load(f)['results']}
+    for result in results:
+        base = before.get(result['job'])
+        if base is None:
+            continue
+        print('{:<16} wall {:>8.2f}s -> {:>8.2f}s ({:+.0%})  '
+              'statements {} -> {}  rss {}kB -> {}kB'.format(
+                  result['job'], base['wall_seconds'],
+                  result['wall_seconds'],
+                  result['wall_seconds'] / base['wall_seconds'] - 1
+                  if base['wall_seconds'] else 0,
+                  base['statements'], result['statements'],
+                  base['peak_rss_kb'], result['peak_rss_kb']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scale', type=parse_scale, default='1M',
+                        help='ledger rows: 1M, 10M, 100M or a number')
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--skew', type=float, default=1.0,
+                        help='zipf exponent of the ledger rows per user, '
+                        '0 for uniform')
+    parser.add_argument('--days', type=int, default=30,
+                        help='days the ledger rows are spread over')
+    parser.add_argument('--streams', type=parse_scale, default=None,
+                        help='stream rows, a tenth of --scale by default')
+    parser.add_argument('--stream-mix', type=parse_mix,
+                        default='expired=0.5,fresh=0.2,resolved=0.3',
+                        help='shares of expired, fresh (under an hour) and '
+                        'resolved streams')
+    parser.add_argument('--jobs', default=','.join(JOBS))
+    parser.add_argument('--random-seed', type=int, default=2019)
+    parser.add_argument('--no-seed', action='store_true',
+                        help='reuse the data of a previous run')
+    parser.add_argument('--label', default=None)
+    parser.add_argument('--output', default=None,
+                        help='JSON results path, stdout when missing')
+    parser.add_argument('--compare', default=None,
+                        help='JSON results of a previous run to compare to')
+    args = parser.parse_args()
+    streams = args.streams if args.streams is not None else args.scale // 10
+
+    random.seed(args.random_seed)
+    seeding = None
+    if not args.no_seed:
+        ts = time()
+        create_tables()
+        seed_ledger(args.scale, args.users, args.skew, args.days)
+        seed_streams(streams, args.stream_mix)
+        seeding = round(time() - ts, 3)
+
+    from src import db
+    # spawned children open their own connections
+    db.engine.dispose()
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for job in args.jobs.split(','):
+        reset(job)
+        queue = context.Queue()
+        process = context.Process(target=measure,
+                                  args=(job, args.days, queue))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            print('{:<16} failed with exit code {}'.format(
+                job, process.exitcode))
+            continue
+        result = queue.get()
+        print('{job:<16} took={wall_seconds:.2f}s rows={rows} '
+              'rows/s={rows_per_second} statements={statements} '
+              'peak_rss={peak_rss_kb}kB'.format(**result))
+        results.append(result)
+
+    document = json.dumps({
+        'label': args.label,
+        'revision': revision(),
+        'started_at': datetime.utcnow().isoformat(),
+        'params': {
+            'rows': args.scale,
+            'users': args.users,
+            'skew': args.skew,
+            'days': args.days,
+            'streams': streams,
+            'stream_mix': args.stream_mix,
+            'random_seed': args.random_seed,
+            'seeded_seconds': seeding
+        },
+        'results': results
+    }, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)),
+                    exist_ok=True)
+        with open(args.output, 'w') as f:
+            f.write(document)
+    else:
+        print(document)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import os
+import gzip
+import json
+import logging
+from collections import OrderedDict
+from datetime import datetime, date
+
+from .db import session
+
+LOGGER = logging.getLogger(__name__)
+
+env = os.environ
+# archiving is enabled when ARCHIVE_DIR is set
+ARCHIVE_DIR = env.get('ARCHIVE_DIR')
+ARCHIVE_COMPRESS_LEVEL = int(env.get('ARCHIVE_COMPRESS_LEVEL', 6))
+ARCHIVE_MAX_OPEN_FILES = int(env.get('ARCHIVE_MAX_OPEN_FILES', 16))
+ARCHIVE_FETCH_SIZE = int(env.get('ARCHIVE_FETCH_SIZE', 1000))
+
+
+def to_json(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+class Archiver(object):
+    """Write rows as gzipped JSON lines, partitioned by their creation date:
+
+        {ARCHIVE_DIR}/{table}/{YYYY}/{MM}/{DD}/{table}-{run}.jsonl.gz
+
+    Each run writes its own files. At most ARCHIVE_MAX_OPEN_FILES are kept
+    open; a file closed earlier is reopened in append mode, which adds a
+    new gzip member readable by any gzip reader.
+    """
+
+    def __init__(self, table, directory=None, date_column='created_date'):
+        self.table = table
+        self.directory = directory or ARCHIVE_DIR
+        self.date_column = date_column
+        self.run = '{}-{}'.format(
+            datetime.utcnow().strftime('%Y%m%dT%H%M%S'), os.getpid())
+        self.files = OrderedDict()
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def path_for(self, row_date):
+        if row_date is None:
+            partition = 'undated'
+        else:
+            partition = row_date.strftime('%Y/%m/%d')
+        return os.path.join(self.directory, self.table, partition,
+                            '{}-{}.jsonl.gz'.format(self.table, self.run))
+
+    def file_for(self, row_date):
+        path = self.path_for(row_date)
+        file = self.files.get(path)
+        if file is not None:
+            self.files.move_to_end(path)
+            return file
+        if len(self.files) >= ARCHIVE_MAX_OPEN_FILES:
+            (_, oldest) = self.files.popitem(last=False)
+            oldest.close()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file = gzip.open(path, 'at', encoding='utf-8',
+                         compresslevel=ARCHIVE_COMPRESS_LEVEL)
+        self.files[path] = file
+        return file
+
+    def write(self, row):
+        file = self.file_for(row.get(self.date_column))
+        file.write(json.dumps(row, default=to_json, ensure_ascii=False))
+        file.write('\n')
+        self.count += 1
+
+    def write_query(self, query):
+        """Stream the rows of a Core select through a server-side cursor,
+        so memory does not grow with the number of archived rows
+        """
+        result = session.connection().execution_options(
+            stream_results=True).execute(query)
+        try:
+            while True:
+                rows = result.fetchmany(ARCHIVE_FETCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    self.write(dict(row))
+        finally:
+            result.close()
+
+    def flush(self):
+        for file in self.files.values():
+            file.flush()
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+        self.files.clear()
+        if self.count:
+            LOGGER.info('Archived {} {} rows into {}'.format(
+                self.count, self.table, self.directory))
+
+
+def open_archiver(table):
+    """Return an Archiver for `table` when archiving is enabled, else None"""
+    if not ARCHIVE_DIR:
+        return None
+    return Archiver(table)
+
+
+def row_of(instance):
+    return {column.name: getattr(instance, column.key)
+            for column in instance.__table__.columns}
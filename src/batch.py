@@ -0,0 +1,175 @@
+import os
+import logging
+from time import time
+from datetime import datetime
+
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.sql.expression import exists
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import lease, metrics
+from .db import session
+from .models import JobFailure
+
+LOGGER = logging.getLogger(__name__)
+
+env = os.environ
+# items failing this many times in a row are no longer picked up
+MAX_FAILURE_RETRIES = int(env.get('MAX_FAILURE_RETRIES', 5))
+# ids per set-based statement in apply_in_chunks
+BATCH_WRITE_CHUNK_SIZE = int(env.get('BATCH_WRITE_CHUNK_SIZE', 500))
+# seconds a BatchLoop keeps taking batches, <JOB>_TIME_BUDGET overrides it
+# for one job
+BATCH_TIME_BUDGET = float(env.get('BATCH_TIME_BUDGET', 240))
+# seconds a batch should take, batch sizes are tuned towards it
+BATCH_TARGET_SECONDS = float(env.get('BATCH_TARGET_SECONDS', 20))
+
+# seconds per item learnt by the previous runs of each job in this process
+item_seconds = {}
+
+
+def exhausted(job, item_id):
+    """Clause matching items of `job` that reached MAX_FAILURE_RETRIES"""
+    return exists().where(
+        (JobFailure.job == job) &
+        (JobFailure.item_id == item_id) &
+        (JobFailure.retries >= MAX_FAILURE_RETRIES))
+
+
+def record_failures(job, failures):
+    if not failures:
+        return
+    now = datetime.utcnow()
+    stmt = insert(JobFailure.__table__).values([{
+        'job': job,
+        'item_id': item_id,
+        'retries': 1,
+        'last_error': '{!r}'.format(error)[:255],
+        'created_date': now
+    } for (item_id, error) in failures])
+    stmt = stmt.on_duplicate_key_update(
+        retries=JobFailure.__table__.c.retries + 1,
+        last_error=stmt.inserted.last_error,
+        updated_date=now
+    )
+    session.execute(stmt)
+
+
+def clear_failures(job, item_ids):
+    if not item_ids:
+        return
+    session.query(JobFailure).filter(
+        JobFailure.job == job,
+        JobFailure.item_id.in_(item_ids)
+    ).delete(synchronize_session=False)
+
+
+def flush_chunk(job, applied, failures):
+    try:
+        clear_failures(job, applied)
+        record_failures(job, failures)
+        session.commit()
+    except SQLAlchemyError as exc:
+        LOGGER.info('[{}] ERROR: {}'.format(job, exc))
+        session.rollback()
+        return [], [item_id for (item_id, _) in failures] + applied
+    return applied, [item_id for (item_id, _) in failures]
+
+
+def apply_in_chunks(job, item_ids, apply, chunk_size=None):
+    """Call apply(chunk_ids) for every chunk of ids, each chunk in its own
+    transaction. A failing chunk is rolled back and logged. Returns the ids
+    of the applied and of the failed items.
+    """
+    chunk_size = chunk_size or BATCH_WRITE_CHUNK_SIZE
+    applied, failed = [], []
+    for offset in range(0, len(item_ids), chunk_size):
+        chunk = item_ids[offset:offset + chunk_size]
+        try:
+            apply(chunk)
+            session.commit()
+            applied.extend(chunk)
+        except SQLAlchemyError as exc:
+            LOGGER.info('[{}] chunk of {} failed: {!r}'.format(
+                job, len(chunk), exc))
+            session.rollback()
+            failed.extend(chunk)
+    return applied, failed
+
+
+def time_budget(job):
+    # the parts of a job, named `<job>:<part>`, share its budget
+    name = job.split(':', 1)[0]
+    return float(env.get('{}_TIME_BUDGET'.format(name.upper()),
+                         BATCH_TIME_BUDGET))
+
+
+class BatchLoop(object):
+    """Take batches until the backlog is drained or the job's time budget
+    is used, sizing each batch from the observed seconds per item so it
+    lasts about BATCH_TARGET_SECONDS and the last one ends in time.
+    """
+
+    def __init__(self, job, size, min_size=1, max_size=None, budget=None,
+                 target=None):
+        self.job = job
+        self.size = size
+        self.min_size = min_size
+        self.max_size = max_size or size * 20
+        self.budget = budget or time_budget(job)
+        self.target = target or BATCH_TARGET_SECONDS
+
+    def next_size(self, per_item, remaining):
+        if per_item is None:
+            return self.size
+        wanted = int(self.target / per_item) if per_item > 0 \
+            else self.max_size
+        # move at most by a factor two, a single odd batch is noise
+        size = max(self.size // 2, min(wanted, self.size * 2))
+        size = min(size, int(remaining / per_item) if per_item > 0
+                   else size)
+        return min(size, self.max_size)
+
+    def run(self, process, backlog=None, pause=None):
+        """Call process(size, deadline) -> items processed, until it
+        processes fewer items than asked or the budget is used. pause(took,
+        deadline) runs between batches; backlog() counts what is left.
+        Returns the number of items processed.
+        """
+        started = time()
+        deadline = started + self.budget
+        per_item = item_seconds.get(self.job)
+        (items, batches, drained) = (0, 0, False)
+        while True:
+            size = self.next_size(per_item, deadline - time())
+            if size < self.min_size:
+                break
+            self.size = size
+            batch_started = time()
+            processed = process(size, deadline)
+            took = time() - batch_started
+            batches += 1
+            items += processed
+            if processed:
+                seconds = took / processed
+                per_item = seconds if per_item is None \
+                    else (per_item + seconds) / 2
+            lease.progress('{} items in {} batches, batch size {}'.format(
+                items, batches, size))
+            if processed < size:
+                drained = True
+                break
+            if pause is not None:
+                pause(took, deadline)
+        if per_item is not None:
+            item_seconds[self.job] = per_item
+
+        left = 0 if drained or backlog is None else backlog()
+        metrics.count('items', items)
+        metrics.count('batches', batches)
+        metrics.count('backlog', left)
+        LOGGER.info('[{}] {} items in {} batches over {:.1f}s, last batch '
+                    'size {}, {:.3f}s per item, backlog {}'.format(
+                        self.job, items, batches, time() - started,
+                        self.size, per_item or 0, left))
+        return items
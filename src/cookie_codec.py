@@ -0,0 +1,83 @@
+import re
+from email.utils import parsedate_tz, mktime_tz
+
+# A comma separates two cookies only when a `name=` follows it. The comma
+# of an Expires date ("Wed, 21-Oct-2020 07:28:00 GMT") is followed by the
+# day of month and is kept inside the attribute.
+COOKIE_SEPARATOR_RE = re.compile(r',\s*(?=[^;,=\s]+=)')
+
+
+def split_headers(headers):
+    """Return the Set-Cookie values of `headers`, which is either a list of
+    header values or the single string requests joins them into
+    """
+    if isinstance(headers, str):
+        return COOKIE_SEPARATOR_RE.split(headers)
+    cookies = []
+    for header in headers:
+        cookies.extend(COOKIE_SEPARATOR_RE.split(header))
+    return cookies
+
+
+def parse_set_cookie(headers):
+    """Parse Set-Cookie headers into (name, value, attributes) tuples, the
+    attribute names lowercased and the values left as sent
+    """
+    cookies = []
+    for cookie in split_headers(headers):
+        parts = cookie.split(';')
+        (name, sep, value) = parts[0].partition('=')
+        if not sep:
+            continue
+        attributes = {}
+        for part in parts[1:]:
+            (key, sep, attribute) = part.partition('=')
+            attributes[key.strip().lower()] = attribute.strip() if sep \
+                else None
+        cookies.append((name.strip(), value.strip(), attributes))
+    return cookies
+
+
+def expires_at(attributes, now):
+    """Return the unix time a cookie expires at, from Max-Age first and
+    Expires then, or None for a session cookie
+    """
+    max_age = attributes.get('max-age')
+    if max_age:
+        try:
+            return int(now) + int(max_age)
+        except ValueError:
+            pass
+    expires = attributes.get('expires')
+    if not expires:
+        return None
+    # handles both the RFC 1123 and the dashed Netscape date formats
+    parsed = parsedate_tz(expires)
+    if parsed is None:
+        return None
+    return mktime_tz(parsed)
+
+
+def merge_cookie(cookie_str, set_cookies):
+    """Apply parsed Set-Cookie values to a `name=value;name=value` cookie
+    string. Known names keep their position, new ones are appended in the
+    order they were set.
+    """
+    updates = {}
+    for (name, value, _) in set_cookies:
+        updates[name] = value
+    merged = []
+    for part in cookie_str.split(';'):
+        (name, sep, value) = part.partition('=')
+        name = name.strip()
+        if not name:
+            continue
+        if name in updates:
+            merged.append('{}={}'.format(name, updates.pop(name)))
+        elif sep:
+            merged.append('{}={}'.format(name, value.strip()))
+        else:
+            merged.append(name)
+    for (name, value) in updates.items():
+        merged.append('{}={}'.format(name, value))
+    return ';'.join(merged)
@@ -0,0 +1,236 @@
+import os
+import shlex
+import signal
+import inspect
+import logging
+import threading
+import importlib
+import concurrent.futures
+from time import time, localtime
+
+from sqlalchemy import event
+
+from . import db
+
+"""
+Logging configuration
+"""
+LOG_FORMAT = ('%(levelname) -10s %(asctime)s %(name) -30s %(threadName) '
+              '-20s: %(message)s')
+LOGGER = logging.getLogger(__name__)
+
+env = os.environ
+CRONS_DIR = env.get('DAEMON_CRONS_DIR', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'crons'))
+# comma separated cron file names, every file of CRONS_DIR when empty
+DAEMON_JOBS = env.get('DAEMON_JOBS', '')
+# threads running jobs, a job never overlaps with itself whatever this is
+DAEMON_WORKERS = int(env.get('DAEMON_WORKERS', 8))
+
+FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+
+def parse_field(field, low, high):
+    """Expand one crontab field (`*`, `*/5`, `1,2`, `1-5/2`) to its set
+    of values
+    """
+    values = set()
+    for part in field.split(','):
+        (span, _, step) = part.partition('/')
+        if span == '*':
+            (first, last) = (low, high)
+        elif '-' in span:
+            (first, last) = (int(x) for x in span.split('-', 1))
+        else:
+            first = last = int(span)
+        values.update(range(first, last + 1, int(step or 1)))
+    # sunday is both 0 and 7
+    if (low, high) == (0, 6) and 7 in values:
+        values.add(0)
+    return values
+
+
+class Schedule(object):
+    def __init__(self, expression):
+        fields = expression.split()
+        (self.minutes, self.hours, self.days, self.months, self.weekdays) = (
+            parse_field(field, low, high)
+            for (field, (low, high)) in zip(fields, FIELD_RANGES))
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def matches(self, t):
+        """Whether the struct_time `t` is a minute the job runs at"""
+        if t.tm_min not in self.minutes or t.tm_hour not in self.hours or \
+                t.tm_mon not in self.months:
+            return False
+        day = t.tm_mday in self.days
+        # struct_time counts weekdays from monday, cron from sunday
+        weekday = (t.tm_wday + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+
+class Job(object):
+    def __init__(self, name, schedule, module, argv):
+        self.name = name
+        self.schedule = schedule
+        self.module = module
+        self.argv = argv
+        self.main = None
+        self.lock = threading.Lock()
+        self.runs = 0
+        self.skipped = 0
+
+    def load(self):
+        """Import the job module once, returning how long it took"""
+        ts = time()
+        main = importlib.import_module(self.module).main
+        if 'argv' in inspect.signature(main).parameters:
+            # an empty argv keeps argparse off the daemon's own arguments
+            self.main = lambda: main(self.argv)
+        else:
+            self.main = main
+        return time() - ts
+
+
+def parse_crontab(name, text):
+    """Return the jobs of one crontab, the ones running `python -m src.X`"""
+    jobs = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split(None, 5)
+        if len(fields) < 6:
+            continue
+        command = shlex.split(fields[5].split('&&')[-1])
+        if '-m' not in command:
+            LOGGER.info('[{}] Not a module command: {}'.format(name, line))
+            continue
+        index = command.index('-m') + 1
+        jobs.append(Job(name, Schedule(' '.join(fields[:5])),
+                        command[index], command[index + 1:]))
+    return jobs
+
+
+def load_jobs(crons_dir=None, names=None):
+    crons_dir = crons_dir or CRONS_DIR
+    names = names or sorted(os.listdir(crons_dir))
+    jobs = []
+    for name in names:
+        with open(os.path.join(crons_dir, name)) as f:
+            jobs.extend(parse_crontab(name, f.read()))
+    return jobs
+
+
+"""
+Connection accounting, per job thread
+"""
+connect_stats = threading.local()
+
+
+def watch_connections(engine):
+    @event.listens_for(engine, 'do_connect')
+    def before_connect(dialect, conn_rec, cargs, cparams):
+        connect_stats.started = time()
+
+    @event.listens_for(engine, 'connect')
+    def after_connect(dbapi_connection, connection_record):
+        started = getattr(connect_stats, 'started', None)
+        if started is None:
+            return
+        connect_stats.count = getattr(connect_stats, 'count', 0) + 1
+        connect_stats.seconds = getattr(connect_stats, 'seconds', 0) + \
+            time() - started
+        connect_stats.started = None
+
+
+def warm_pool(engine):
+    """Open a first connection so the first job does not pay for it"""
+    ts = time()
+    with engine.connect() as connection:
+        connection.execute('SELECT 1')
+    return time() - ts
+
+
+class Daemon(object):
+    def __init__(self, jobs, workers=None):
+        self.jobs = jobs
+        self.stopping = threading.Event()
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers or DAEMON_WORKERS,
+            thread_name_prefix='job')
+
+    def start(self):
+        for job in self.jobs:
+            LOGGER.info('[{}] Loaded {} in {:.3f}s'.format(
+                job.name, job.module, job.load()))
+        watch_connections(db.engine)
+        try:
+            LOGGER.info('Connection pool warmed in {:.3f}s'.format(
+                warm_pool(db.engine)))
+        except Exception as exc:
+            LOGGER.info('Error: {}'.format(exc))
+
+    def run_job(self, job):
+        connect_stats.count = 0
+        connect_stats.seconds = 0
+        ts = time()
+        try:
+            job.main()
+        except Exception:
+            LOGGER.exception('[{}] Failed'.format(job.name))
+        finally:
+            # hand the thread's connection back to the pool for the next job
+            db.session.remove()
+            job.runs += 1
+            job.lock.release()
+        LOGGER.info('[{}] Run #{} took {:.3f}s, {} new connections in '
+                    '{:.3f}s'.format(job.name, job.runs, time() - ts,
+                                     connect_stats.count,
+                                     connect_stats.seconds))
+
+    def tick(self, t):
+        for job in self.jobs:
+            if not job.schedule.matches(t):
+                continue
+            if not job.lock.acquire(blocking=False):
+                job.skipped += 1
+                LOGGER.info('[{}] Still running, skipped ({} so far)'.format(
+                    job.name, job.skipped))
+                continue
+            self.executor.submit(self.run_job, job)
+
+    def run(self):
+        # crond runs what is due at the start of every minute
+        next_minute = (int(time()) // 60 + 1) * 60
+        while not self.stopping.wait(max(0, next_minute - time())):
+            self.tick(localtime(next_minute))
+            next_minute += 60
+            # a suspended host skips the minutes it missed, like crond
+            if next_minute <= time():
+                next_minute = (int(time()) // 60 + 1) * 60
+        LOGGER.info('Stopping, waiting for running jobs')
+        self.executor.shutdown(wait=True)
+
+    def stop(self, *args):
+        self.stopping.set()
+
+
+def main():
+    names = [name for name in DAEMON_JOBS.split(',') if name]
+    daemon = Daemon(load_jobs(names=names))
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    ts = time()
+    daemon.start()
+    LOGGER.info('Started {} jobs in {:.3f}s'.format(
+        len(daemon.jobs), time() - ts))
+    daemon.run()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    main()
@@ -1,8 +1,9 @@
 import os
 from sqlalchemy.orm import sessionmaker, scoped_session
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Text, DateTime, BigInteger
+from sqlalchemy import Column, Integer, String, Text, DateTime, BigInteger, \
+    UniqueConstraint, Index
 
 __all__ = [
     'Column',
@@ -10,7 +11,9 @@ __all__ = [
     'String',
     'Text',
     'DateTime',
-    'BigInteger'
+    'BigInteger',
+    'UniqueConstraint',
+    'Index'
 ]
 
 """
@@ -33,3 +36,33 @@ session = scoped_session(Session)
 SQLAlchemy model
 """
 Model = declarative_base()
+
+
+class MissingUniqueKey(Exception):
+    pass
+
+
+def unique_keys(inspector, table_name):
+    """Column sets of the unique keys the database has on table_name"""
+    keys = [frozenset(inspector.get_pk_constraint(
+        table_name)['constrained_columns'])]
+    keys.extend(frozenset(constraint['column_names']) for constraint
+                in inspector.get_unique_constraints(table_name))
+    keys.extend(frozenset(index['column_names']) for index
+                in inspector.get_indexes(table_name) if index['unique'])
+    return set(keys)
+
+
+def require_unique_key(table_name, columns):
+    """Refuse to go on when the upserts into table_name would insert
+    duplicates instead of updating, because the database lacks their key
+    """
+    inspector = inspect(engine)
+    if table_name not in inspector.get_table_names():
+        raise MissingUniqueKey(
+            '{} does not exist, run `python -m src.indexes apply` '
+            'first'.format(table_name))
+    if frozenset(columns) not in unique_keys(inspector, table_name):
+        raise MissingUniqueKey(
+            '{} has no unique key on ({}), run `python -m src.indexes '
+            'apply` first'.format(table_name, ', '.join(columns)))
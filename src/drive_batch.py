@@ -0,0 +1,134 @@
+import os
+import re
+import json
+import uuid
+import logging
+from urllib.parse import quote
+
+import requests
+
+from . import metrics
+from .key_pool import QuotaError, is_quota_error
+
+LOGGER = logging.getLogger(__name__)
+
+env = os.environ
+GDRIVE_BATCH_URL = env.get(
+    'GDRIVE_BATCH_URL', 'https://www.googleapis.com/batch/drive/v3')
+GDRIVE_FILE_FIELDS = 'id,name,mimeType,size'
+
+CONTENT_ID_RE = re.compile(r'<response-item-(\d+)>')
+
+
+class DriveBatchError(Exception):
+    pass
+
+
+def build_batch_body(drive_ids, api_key, boundary):
+    parts = []
+    for (index, drive_id) in enumerate(drive_ids):
+        parts.append(
+            '--{boundary}\r\n'
+            'Content-Type: application/http\r\n'
+            'Content-ID: <item-{index}>\r\n'
+            '\r\n'
+            'GET /drive/v3/files/{drive_id}?fields={fields}&key={key}\r\n'
+            '\r\n'.format(boundary=boundary, index=index,
+                          drive_id=quote(drive_id, safe=''),
+                          fields=GDRIVE_FILE_FIELDS,
+                          key=quote(api_key or '', safe='')))
+    parts.append('--{}--\r\n'.format(boundary))
+    return ''.join(parts)
+
+
+def boundary_of(content_type):
+    for param in content_type.split(';')[1:]:
+        (name, _, value) = param.strip().partition('=')
+        if name.lower() == 'boundary':
+            return value.strip('"')
+    raise DriveBatchError('no boundary in {}'.format(content_type))
+
+
+def split_headers(text):
+    (head, _, body) = text.partition('\r\n\r\n')
+    if not _:
+        (head, _, body) = text.partition('\n\n')
+    return head.splitlines(), body
+
+
+def parse_part(part):
+    """Return (index, status_code, body) of one multipart/mixed part, which
+    wraps a whole HTTP response
+    """
+    (part_headers, response) = split_headers(part.strip('\r\n'))
+    index = None
+    for header in part_headers:
+        (name, _, value) = header.partition(':')
+        if name.strip().lower() == 'content-id':
+            match = CONTENT_ID_RE.search(value)
+            index = int(match.group(1)) if match else None
+    (response_headers, body) = split_headers(response)
+    if index is None or not response_headers:
+        raise DriveBatchError('malformed part {!r}'.format(part[:200]))
+    status_code = int(response_headers[0].split()[1])
+    return index, status_code, body
+
+
+def parse_batch_response(content_type, text):
+    """Return {index: (status_code, body)} of a batch response"""
+    delimiter = '--' + boundary_of(content_type)
+    results = {}
+    for part in text.split(delimiter)[1:]:
+        if part.startswith('--'):
+            break
+        try:
+            (index, status_code, body) = parse_part(part)
+        except (DriveBatchError, ValueError, IndexError) as exc:
+            LOGGER.info('ERROR: {}'.format(exc))
+            continue
+        results[index] = (status_code, body)
+    return results
+
+
+def to_file(status_code, body):
+    if is_quota_error(status_code, body):
+        raise QuotaError('status {}'.format(status_code))
+    if status_code != 200:
+        raise DriveBatchError('status {}'.format(status_code))
+    file = json.loads(body)
+    return {'name': file['name'], 'size': int(file['size'])}
+
+
+def get_drive_infos(drive_ids, api_key, headers=None):
+    """Look up the metadata of every drive id with one batch request.
+    Returns a list aligned with drive_ids of (file, error) pairs; a missing
+    or failed item only fails itself.
+    """
+    boundary = 'batch_{}'.format(uuid.uuid4().hex)
+    req = requests.post(
+        GDRIVE_BATCH_URL,
+        params={'key': api_key},
+        data=build_batch_body(drive_ids, api_key, boundary),
+        headers=dict(headers or {}, **{
+            'content-type': 'multipart/mixed; boundary={}'.format(boundary)
+        }),
+        timeout=60,
+        hooks=metrics.http_hook('drive_batch'),
+    )
+    if is_quota_error(req.status_code, req.text):
+        raise QuotaError('batch status {}'.format(req.status_code))
+    if req.status_code != 200:
+        raise DriveBatchError('batch status {}'.format(req.status_code))
+    results = parse_batch_response(req.headers.get('content-type', ''),
+                                   req.text)
+    infos = []
+    for index in range(len(drive_ids)):
+        if index not in results:
+            infos.append((None, DriveBatchError('missing in batch')))
+            continue
+        try:
+            infos.append((to_file(*results[index]), None))
+        except (DriveBatchError, QuotaError, ValueError, KeyError,
+                TypeError) as exc:
+            infos.append((None, exc))
+    return infos
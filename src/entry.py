@@ -0,0 +1,31 @@
+import functools
+
+from .lease import held
+from .metrics import track
+from .profiling import profiled
+
+
+def job(name, lease_name=None, single_flight=True):
+    """Decorate the main() of a job: every call holds the job's lease, is
+    tracked as a metrics run and profiled when profiling is turned on. A
+    call finding the lease held by another run returns None right away,
+    or after JOB_LEASE_WAIT seconds.
+
+    lease_name, a string or a function returning one, names the lease when
+    it is not the job name. Jobs built to run in parallel pass
+    single_flight=False.
+    """
+    def decorate(main):
+        @functools.wraps(main)
+        def wrapper(*args, **kwargs):
+            if not single_flight:
+                with track(name), profiled(name):
+                    return main(*args, **kwargs)
+            lease = lease_name() if callable(lease_name) else lease_name
+            with held(lease or name) as acquired:
+                if not acquired:
+                    return None
+                with track(name), profiled(name):
+                    return main(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,365 @@
+"""
+Index management for the job tables.
+
+    python -m src.indexes apply [--dry-run]
+    python -m src.indexes check
+
+`apply` brings the database to the schema declared in src/models.py:
+missing tables, columns, unique keys and indexes are created, online on
+MySQL, and it can run again safely. A unique key is not added while the
+table holds duplicates of it. `check` runs EXPLAIN on the queries the jobs
+really send and fails when one of them scans a whole table, sorts with a
+filesort or reads far more rows than its LIMIT returns. The optimizer
+picks full scans over tiny tables, so point the check at a database with
+production-sized data, a replica or a staging copy.
+"""
+import os
+import sys
+import logging
+import argparse
+from time import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, inspect, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.schema import CreateColumn, CreateIndex, UniqueConstraint
+
+from . import db
+from . import (clean_stream, key_pool, refresh_cookie, report, report_rollup,
+               update_balance, update_drive_info, verify_stream_result,
+               watermark)
+
+"""
+Logging configuration
+"""
+LOG_FORMAT = ('%(levelname) -10s %(asctime)s %(name) -30s %(funcName) '
+              '-35s %(lineno) -5d: %(message)s')
+LOGGER = logging.getLogger(__name__)
+
+env = os.environ
+# a LIMIT query planned to read more than this many times its LIMIT, most
+# of them discarded by its WHERE, fails the check
+INDEX_CHECK_ROWS_FACTOR = int(env.get('INDEX_CHECK_ROWS_FACTOR', 10))
+# unique keys whose duplicates `apply --delete-duplicates` may delete
+# before adding the key. The oldest row of each key is kept, the one the
+# jobs read and updated until then.
+DISPOSABLE_DUPLICATES = {
+    ('report_earning', ('date',)),
+}
+
+
+def job_queries():
+    """Return (name, statement, params, allowed) for every hot query of
+    the jobs, built by the jobs' own functions with representative
+    parameters. params fills the bindparams of executemany statements and
+    `allowed` lists the EXPLAIN findings accepted for that query.
+    """
+    now = int(time())
+    (begin, end) = report.timestamp_range(datetime.now() - timedelta(days=1))
+    queries = [
+        # opt-in `recent` mode, the default watermark mode does not sort
+        ('update_balance.recent_active_users',
+         update_balance.recent_active_users(),
+         {'filesort', 'reads past limit'}),
+        ('update_balance.user_balance_since',
+         update_balance.user_balance_since(1, 0), set()),
+        ('update_balance.balance_chunk',
+         update_balance.balance_chunk(0, update_balance.BALANCE_CHUNK_SIZE),
+         set()),
+        # stops at the first settled row walking the range down
+        ('watermark.settled_ledger_ids', watermark.settled_ledger_ids(
+            0, update_balance.BALANCE_CHUNK_SIZE, now * 1000000),
+         {'reads past limit'}),
+        ('report.ledger_totals', report.ledger_totals(begin, end), set()),
+        ('report.ledger_rows', report.ledger_rows(begin, end), set()),
+        ('report.rollup_totals', report.rollup_totals(begin, end), set()),
+        ('report_rollup.hourly_chunk',
+         report_rollup.hourly_chunk(0, report_rollup.ROLLUP_CHUNK_SIZE),
+         set()),
+        ('clean_stream.expired_ids', clean_stream.expired_ids(
+            datetime.utcnow() - timedelta(hours=1),
+            clean_stream.CLEAN_STREAM_CHUNK_SIZE), set()),
+        ('verify_stream_result.unchecked_streams',
+         verify_stream_result.unchecked_streams(
+             verify_stream_result.VERIFY_BATCH_SIZE), set()),
+        ('verify_stream_result.overdue_streams',
+         verify_stream_result.overdue_streams(
+             now, verify_stream_result.VERIFY_BATCH_SIZE), set()),
+        ('update_drive_info.claim_statement',
+         update_drive_info.claim_statement(
+             'check', now, update_drive_info.MAX_UPDATED_STREAM), set()),
+        ('update_drive_info.leased_streams',
+         update_drive_info.leased_streams('check'), set()),
+        ('update_drive_info.source_update', update_drive_info.source_update(),
+         set()),
+        ('refresh_cookie.due_cookies', refresh_cookie.due_cookies(
+            now, refresh_cookie.COOKIE_PAGE_SIZE), set()),
+        ('key_pool.active_keys', key_pool.active_keys(), set()),
+    ]
+    executemany_params = {
+        'update_drive_info.source_update': {
+            'b_source_id': 'check', 'b_title': 'check', 'b_size': 0}
+    }
+    return [(name, getattr(statement, 'statement', statement),
+             executemany_params.get(name), allowed)
+            for (name, statement, allowed) in queries]
+
+
+def explain(engine, statement, params=None):
+    """Return the EXPLAIN rows of statement as dicts"""
+    compiled = statement.compile(dialect=engine.dialect)
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN ' + str(compiled),
+                       compiled.construct_params(params))
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+
+def limit_of(statement):
+    limit = getattr(statement, '_limit', None)
+    if limit is None:
+        limit = getattr(statement, 'dialect_kwargs', {}).get('mysql_limit')
+    return limit
+
+
+def findings_of(plan, limit=None):
+    """Return what is wrong with an EXPLAIN plan, as (kind, table). A
+    LIMIT query walking an index that does not cover its WHERE reads far
+    more rows than it returns, which EXPLAIN shows as a large `rows` with a
+    `filtered` below 100. MySQL 5.6 has no `filtered`, so there `rows`
+    alone decides.
+    """
+    findings = []
+    for row in plan:
+        if row.get('type') == 'ALL':
+            findings.append(('full scan', row.get('table')))
+        if 'Using filesort' in (row.get('Extra') or ''):
+            findings.append(('filesort', row.get('table')))
+        filtered = row.get('filtered')
+        if limit and (row.get('rows') or 0) > limit * INDEX_CHECK_ROWS_FACTOR \
+                and (filtered is None or float(filtered) < 100):
+            findings.append(('reads past limit', row.get('table')))
+    return findings
+
+
+def check(engine):
+    if engine.dialect.name != 'mysql':
+        raise RuntimeError('EXPLAIN checks need MySQL, not {}'.format(
+            engine.dialect.name))
+    failed = []
+    for (name, statement, params, allowed) in job_queries():
+        plan = explain(engine, statement, params)
+        findings = [(kind, table) for (kind, table)
+                    in findings_of(plan, limit_of(statement))
+                    if kind not in allowed]
+        for row in plan:
+            LOGGER.info('{}: table {} type {} key {} rows {} filtered {} '
+                        '{}'.format(name, row.get('table'), row.get('type'),
+                                    row.get('key'), row.get('rows'),
+                                    row.get('filtered'),
+                                    row.get('Extra') or ''))
+        if findings:
+            failed.append(name)
+            LOGGER.info('FAIL {}: {}'.format(name, ', '.join(
+                '{} on {}'.format(kind, table) for (kind, table) in findings)))
+        else:
+            LOGGER.info('OK {}'.format(name))
+    return failed
+
+
+def online(engine, ddl, separator=' '):
+    if engine.dialect.name == 'mysql':
+        # the job tables stay writable while it runs
+        ddl += separator.join(['', 'ALGORITHM=INPLACE', 'LOCK=NONE'])
+    return ddl
+
+
+def create_index_ddl(engine, index):
+    return online(engine, str(CreateIndex(index).compile(
+        dialect=engine.dialect)))
+
+
+def add_column_ddl(engine, column):
+    """ALTER adding column to its table. Existing rows of a NOT NULL column
+    get its server default, or its scalar ORM default.
+    """
+    preparer = engine.dialect.identifier_preparer
+    ddl = 'ALTER TABLE {} ADD COLUMN {}'.format(
+        preparer.format_table(column.table),
+        CreateColumn(column).compile(dialect=engine.dialect))
+    if not column.nullable and column.server_default is None \
+            and column.default is not None and column.default.is_scalar:
+        ddl += ' DEFAULT {}'.format(
+            engine.dialect.statement_compiler(engine.dialect, None)
+            .render_literal_value(column.default.arg, column.type))
+    return online(engine, ddl, ', ')
+
+
+def unique_key_name(table, columns):
+    return 'uq_{}_{}'.format(table.name, '_'.join(columns))
+
+
+def add_unique_ddl(engine, constraint):
+    preparer = engine.dialect.identifier_preparer
+    columns = [column.name for column in constraint.columns]
+    return online(engine, 'CREATE UNIQUE INDEX {} ON {} ({})'.format(
+        preparer.quote(constraint.name
+                       or unique_key_name(constraint.table, columns)),
+        preparer.format_table(constraint.table),
+        ', '.join(preparer.quote(column) for column in columns)))
+
+
+def has_duplicates(engine, constraint):
+    columns = list(constraint.columns)
+    with engine.connect() as connection:
+        return connection.execute(
+            select(columns).group_by(*columns).having(
+                func.count() > 1).limit(1)).first() is not None
+
+
+def delete_duplicates(constraint):
+    """DELETE of every row but the oldest of each duplicated key"""
+    table = constraint.table
+    oldest = select([func.min(table.c.id).label('id')]).group_by(
+        *constraint.columns).alias('oldest')
+    # the derived table spares MySQL error 1093 on the deleted table
+    return table.delete().where(table.c.id.notin_(select([oldest.c.id])))
+
+
+def run_ddl(engine, ddl):
+    ts = time()
+    with engine.connect() as connection:
+        connection.execute(ddl)
+    LOGGER.info('Took {}'.format(time() - ts))
+
+
+def table_changes(engine, inspector, table, dedupe=False):
+    """Yield (what, ddl, columns) for everything table misses in the
+    database, columns first so the keys and indexes on them can follow.
+    `columns` are the columns the change needs, ddl is None when it cannot
+    be made as is. Duplicates blocking a unique key are only deleted with
+    dedupe.
+    """
+    present_columns = set(column['name']
+                          for column in inspector.get_columns(table.name))
+    for column in table.columns:
+        if column.name not in present_columns:
+            yield 'column {}'.format(column.name), \
+                add_column_ddl(engine, column), [column.name]
+
+    present_keys = db.unique_keys(inspector, table.name)
+    constraints = sorted(
+        (constraint for constraint in table.constraints
+         if isinstance(constraint, UniqueConstraint)),
+        key=lambda constraint: [column.name
+                                for column in constraint.columns])
+    for constraint in constraints:
+        columns = [column.name for column in constraint.columns]
+        what = 'unique key ({})'.format(', '.join(columns))
+        if frozenset(columns) in present_keys:
+            LOGGER.info('{}.{} present'.format(table.name, what))
+        elif set(columns) <= present_columns \
+                and has_duplicates(engine, constraint):
+            disposable = (table.name, tuple(columns)) in DISPOSABLE_DUPLICATES
+            if disposable and dedupe:
+                yield 'duplicates of ({})'.format(', '.join(columns)), \
+                    ' '.join(str(delete_duplicates(constraint).compile(
+                        dialect=engine.dialect)).split()), columns
+                yield what, add_unique_ddl(engine, constraint), columns
+                continue
+            LOGGER.info('{} has duplicates of ({}), {}'.format(
+                table.name, ', '.join(columns),
+                'rerun with --delete-duplicates to keep the oldest row of '
+                'each' if disposable else 'remove them first'))
+            yield what, None, columns
+        else:
+            yield what, add_unique_ddl(engine, constraint), columns
+
+    present_indexes = set(index['name']
+                          for index in inspector.get_indexes(table.name))
+    for index in sorted(table.indexes, key=lambda index: index.name):
+        if index.name in present_indexes:
+            LOGGER.info('{}.{} present'.format(table.name, index.name))
+        else:
+            yield index.name, create_index_ddl(engine, index), \
+                [column.name for column in index.columns]
+
+
+def apply(engine, dry_run=False, dedupe=False):
+    """Create the missing tables, columns, unique keys and indexes. Returns
+    the DDL run and what could not be changed.
+    """
+    metadata = db.Model.metadata
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    (statements, failed) = ([], [])
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            # a new table comes with its keys and indexes
+            LOGGER.info('Creating table {}'.format(table.name))
+            if not dry_run:
+                table.create(engine)
+            continue
+        missing_columns = set()
+        for (what, ddl, columns) in list(
+                table_changes(engine, inspector, table, dedupe)):
+            needed = missing_columns.intersection(columns)
+            if ddl is None or needed:
+                if needed:
+                    LOGGER.info('{}.{} skipped, column {} is missing'.format(
+                        table.name, what, ', '.join(sorted(needed))))
+                failed.append('{}.{}'.format(table.name, what))
+                continue
+            LOGGER.info('{}.{}: {}'.format(table.name, what, ddl))
+            statements.append(ddl)
+            if dry_run:
+                continue
+            try:
+                run_ddl(engine, ddl)
+            except SQLAlchemyError as exc:
+                LOGGER.info('Error: {}'.format(exc))
+                failed.append('{}.{}'.format(table.name, what))
+                if what.startswith('column '):
+                    missing_columns.update(columns)
+    return statements, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Job table indexes')
+    commands = parser.add_subparsers(dest='command')
+    apply_parser = commands.add_parser(
+        'apply', help='create the missing tables and indexes')
+    apply_parser.add_argument('--dry-run', action='store_true',
+                              help='only log the DDL')
+    apply_parser.add_argument('--delete-duplicates', action='store_true',
+                              help='delete the rows blocking a unique key '
+                              'where that is safe, keeping the oldest')
+    commands.add_parser('check', help='EXPLAIN the job queries')
+    args = parser.parse_args(argv)
+
+    if args.command == 'apply':
+        (_, failed) = apply(db.engine, args.dry_run,
+                            args.delete_duplicates)
+        if failed:
+            LOGGER.info('{} changes not applied: {}'.format(
+                len(failed), ', '.join(failed)))
+            return 1
+        return 0
+    if args.command == 'check':
+        failed = check(db.engine)
+        if failed:
+            LOGGER.info('{} queries need an index: {}'.format(
+                len(failed), ', '.join(failed)))
+            return 1
+        return 0
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    sys.exit(main())
@@ -0,0 +1,181 @@
+import os
+import json
+import logging
+import threading
+from time import time, sleep
+from datetime import datetime
+
+from sqlalchemy import case
+from sqlalchemy.exc import SQLAlchemyError
+
+from .db import session
+from .models import Config
+
+LOGGER = logging.getLogger(__name__)
+
+env = os.environ
+# sustained requests per second and burst allowed to every key
+GDRIVE_KEY_RATE = float(env.get('GDRIVE_KEY_RATE', 5))
+GDRIVE_KEY_BURST = int(env.get('GDRIVE_KEY_BURST', 10))
+# seconds a key is left aside after a quota error
+GDRIVE_KEY_COOLDOWN = int(env.get('GDRIVE_KEY_COOLDOWN', 600))
+
+QUOTA_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded',
+                 'dailyLimitExceeded', 'quotaExceeded')
+
+
+class QuotaError(Exception):
+    pass
+
+
+class NoKeyError(Exception):
+    pass
+
+
+def get_unix_time(ts=None):
+    unix_time = datetime.timestamp(datetime.now()) if ts is None else ts
+    unix_time = '{:.6f}'.format(unix_time).replace('.', '')
+    unix_time = unix_time.ljust(16, '0')
+    unix_time = int(unix_time)
+    return unix_time
+
+
+def is_quota_error(status_code, body):
+    if status_code == 429:
+        return True
+    if status_code != 403:
+        return False
+    try:
+        errors = json.loads(body)['error']['errors']
+    except (ValueError, KeyError, TypeError):
+        return False
+    return any(error.get('reason') in QUOTA_REASONS for error in errors)
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time()
+
+    def wait_time(self, now):
+        """Refill, then take a token and return 0, or return the seconds
+        until one is available
+        """
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class ApiKey(object):
+    def __init__(self, config_id, value, rate, burst):
+        self.id = config_id
+        self.value = value
+        self.bucket = TokenBucket(rate, burst)
+        self.sidelined_until = 0
+        self.used_at = None
+
+
+def active_keys():
+    return session.query(Config).with_entities(
+        Config.id, Config.value
+    ).filter_by(
+        key='GDRIVE_API_KEY', status=Config.ACTIVE_STATUS
+    ).order_by(Config.updated_timestamp.asc())
+
+
+class KeyPool(object):
+    """Every active GDRIVE_API_KEY of the configs table, each rate limited
+    by its own token bucket. Thread safe.
+    """
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.lock = threading.Lock()
+        self.next = 0
+
+    @classmethod
+    def load(cls, rate=None, burst=None):
+        rows = active_keys().all()
+        session.commit()
+        LOGGER.info('Loaded {} api keys'.format(len(rows)))
+        return cls([ApiKey(config_id, value, rate or GDRIVE_KEY_RATE,
+                           burst or GDRIVE_KEY_BURST)
+                    for (config_id, value) in rows])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def try_acquire(self):
+        """Return (key, 0) or (None, seconds to wait before retrying)"""
+        with self.lock:
+            now = time()
+            wait = None
+            for offset in range(len(self.keys)):
+                key = self.keys[(self.next + offset) % len(self.keys)]
+                if key.sidelined_until > now:
+                    continue
+                # the cooldown is over, the key is back in the rotation
+                key.sidelined_until = 0
+                key_wait = key.bucket.wait_time(now)
+                if key_wait == 0:
+                    self.next = (self.next + offset + 1) % len(self.keys)
+                    key.used_at = now
+                    return key, 0
+                wait = key_wait if wait is None else min(wait, key_wait)
+            if wait is None:
+                raise NoKeyError('every api key is sidelined')
+            return None, wait
+
+    def acquire(self):
+        while True:
+            (key, wait) = self.try_acquire()
+            if key is not None:
+                return key
+            sleep(wait)
+
+    def sideline(self, key):
+        with self.lock:
+            key.sidelined_until = time() + GDRIVE_KEY_COOLDOWN
+        LOGGER.info('Api key {} sidelined for {}s'.format(
+            key.id, GDRIVE_KEY_COOLDOWN))
+
+    def call(self, fetch, attempts=3):
+        """Run fetch(api_key) with the next available key, moving to another
+        key when one answers with a quota error
+        """
+        for _ in range(attempts):
+            key = self.acquire()
+            try:
+                return fetch(key.value)
+            except QuotaError:
+                self.sideline(key)
+        raise QuotaError('quota exceeded on {} keys'.format(attempts))
+
+    def write_back(self):
+        """Persist the state of every used key with a single UPDATE.
+        updated_timestamp orders the keys for every consumer, so a
+        sidelined key is stamped at the end of its cooldown to be picked
+        last until then.
+        """
+        stamps = {}
+        for key in self.keys:
+            if key.sidelined_until:
+                stamps[key.id] = get_unix_time(key.sidelined_until)
+            elif key.used_at is not None:
+                stamps[key.id] = get_unix_time(key.used_at)
+        if not stamps:
+            return
+        try:
+            session.query(Config).filter(Config.id.in_(list(stamps))).update({
+                Config.updated_timestamp: case(stamps, value=Config.id)
+            }, synchronize_session=False)
+            session.commit()
+        except SQLAlchemyError as exc:
+            session.rollback()
+            LOGGER.info('ERROR: {}'.format(exc))
@@ -0,0 +1,181 @@
+import os
+import uuid
+import socket
+import logging
+import threading
+from time import time, sleep
+from contextlib import contextmanager
+
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.expression import or_
+
+from . import db
+from .models import JobLease
+
+"""
+Logging configuration
+"""
+LOG_FORMAT = ('%(levelname) -10s %(asctime)s %(name) -30s %(funcName) '
+              '-35s %(lineno) -5d: %(message)s')
+LOGGER = logging.getLogger(__name__)
+
+env = os.environ
+# seconds a lease lives without a heartbeat, so a killed run blocks the
+# next ones at most that long. Heartbeats go out every third of it.
+JOB_LEASE_TTL = int(env.get('JOB_LEASE_TTL', 120))
+# seconds a run waits for the lease held by another one before giving up
+JOB_LEASE_WAIT = float(env.get('JOB_LEASE_WAIT', 0))
+JOB_LEASE_POLL = float(env.get('JOB_LEASE_POLL', 5))
+
+local = threading.local()
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def new_holder():
+    return '{}:{}:{}'.format(
+        socket.gethostname()[:40], os.getpid(), uuid.uuid4().hex[:8])
+
+
+class Lease(object):
+    """Single-flight lease on a job name, stored in job_leases so
+    operators see who runs what, since when, and how far it got
+    """
+
+    def __init__(self, name, ttl=None, holder=None):
+        self.name = name
+        self.ttl = ttl or JOB_LEASE_TTL
+        self.holder = holder or new_holder()
+        self.progress = None
+        self.lost = False
+        self.renewed_at = None
+        self.stopping = threading.Event()
+        self.heartbeat = None
+
+    def try_acquire(self):
+        table = JobLease.__table__
+        now = int(time())
+        with db.engine.begin() as conn:
+            conn.execute(insert(table).prefix_with('IGNORE').values(
+                name=self.name))
+            acquired = conn.execute(table.update().where(
+                (table.c.name == self.name)
+                & or_(table.c.holder.is_(None), table.c.expires_at < now)
+            ).values(
+                holder=self.holder, started_at=now, heartbeat_at=now,
+                expires_at=now + self.ttl, finished_at=None, progress=None
+            )).rowcount == 1
+        if acquired:
+            self.renewed_at = now
+        return acquired
+
+    def current(self):
+        """Return the lease row as it is, for logging who holds it"""
+        table = JobLease.__table__
+        with db.engine.connect() as conn:
+            return conn.execute(table.select().where(
+                table.c.name == self.name)).first()
+
+    def acquire(self, wait=None):
+        deadline = time() + (JOB_LEASE_WAIT if wait is None else wait)
+        while not self.try_acquire():
+            if time() >= deadline:
+                return False
+            sleep(min(JOB_LEASE_POLL, max(0, deadline - time())))
+        self.heartbeat = threading.Thread(
+            target=self.beat, name='lease-{}'.format(self.name), daemon=True)
+        self.heartbeat.start()
+        return True
+
+    def renew(self):
+        table = JobLease.__table__
+        now = int(time())
+        with db.engine.begin() as conn:
+            renewed = conn.execute(table.update().where(
+                (table.c.name == self.name)
+                & (table.c.holder == self.holder)
+            ).values(
+                heartbeat_at=now, expires_at=now + self.ttl,
+                progress=self.progress
+            )).rowcount == 1
+        if not renewed:
+            raise LeaseLost(self.name)
+        self.renewed_at = now
+
+    def expired(self):
+        """Whether another run may hold the lease by now: it was taken
+        over, or no heartbeat got through for a whole ttl
+        """
+        return self.lost or (self.renewed_at is not None and
+                             time() - self.renewed_at >= self.ttl)
+
+    def beat(self):
+        while not self.stopping.wait(self.ttl / 3.0):
+            try:
+                self.renew()
+            except LeaseLost:
+                self.lost = True
+                LOGGER.info('[{}] Lease lost, another run may have '
+                            'started'.format(self.name))
+                return
+            except SQLAlchemyError as exc:
+                # the lease outlives a few failed heartbeats
+                LOGGER.info('Error: {}'.format(exc))
+
+    def release(self):
+        self.stopping.set()
+        if self.heartbeat is not None:
+            self.heartbeat.join()
+        table = JobLease.__table__
+        now = int(time())
+        with db.engine.begin() as conn:
+            conn.execute(table.update().where(
+                (table.c.name == self.name)
+                & (table.c.holder == self.holder)
+            ).values(
+                holder=None, heartbeat_at=now, expires_at=None,
+                finished_at=now, progress=self.progress
+            ))
+
+
+def progress(text):
+    """Record how far the current run got, written with the next
+    heartbeat. Costs an attribute write, so loops may call it every chunk.
+    Raises LeaseLost once the lease may belong to another run, which stops
+    the loop before its next chunk.
+    """
+    lease = getattr(local, 'lease', None)
+    if lease is not None:
+        if lease.expired():
+            LOGGER.info('[{}] Lease lost, stopping'.format(lease.name))
+            raise LeaseLost(lease.name)
+        lease.progress = str(text)[:255]
+
+
+@contextmanager
+def held(name, wait=None):
+    """Hold the lease on name for the block. Yields False, without
+    holding anything, when another run keeps it past `wait` seconds.
+    """
+    lease = Lease(name)
+    if not lease.acquire(wait):
+        row = lease.current()
+        LOGGER.info('[{}] Already running on {} since {}, at {}'.format(
+            name, row.holder, row.started_at, row.progress)
+            if row is not None else '[{}] Lease busy'.format(name))
+        yield False
+        return
+    previous = getattr(local, 'lease', None)
+    local.lease = lease
+    try:
+        yield True
+    finally:
+        local.lease = previous
+        try:
+            lease.release()
+        except SQLAlchemyError as exc:
+            # it expires by itself after JOB_LEASE_TTL
+            LOGGER.info('Error: {}'.format(exc))
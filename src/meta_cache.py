@@ -0,0 +1,119 @@
+import os
+import sqlite3
+import logging
+import threading
+from time import time
+
+LOGGER = logging.getLogger(__name__)
+
+env = os.environ
+# Drive metadata cache shared by runs, disabled when the path is unset
+DRIVE_CACHE_PATH = env.get('DRIVE_CACHE_PATH')
+DRIVE_CACHE_TTL = int(env.get('DRIVE_CACHE_TTL', 7 * 86400))
+DRIVE_CACHE_MAX_ENTRIES = int(env.get('DRIVE_CACHE_MAX_ENTRIES', 200000))
+# seconds a worker waits for another one holding the cache file lock
+DRIVE_CACHE_BUSY_TIMEOUT = float(env.get('DRIVE_CACHE_BUSY_TIMEOUT', 5))
+# sqlite refuses more than 999 variables per statement
+CHUNK_SIZE = 500
+
+
+class MetaCache(object):
+    """Drive file metadata keyed by source_id in a local sqlite file.
+    Entries older than `ttl` seconds are misses, and the oldest entries are
+    evicted beyond `max_entries`. The file is shared by concurrent workers:
+    a read it fails is a miss and a write it fails is skipped, so a locked
+    cache never fails the batch.
+    """
+
+    def __init__(self, path, ttl=None, max_entries=None, timeout=None):
+        self.ttl = ttl or DRIVE_CACHE_TTL
+        self.max_entries = max_entries or DRIVE_CACHE_MAX_ENTRIES
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            path, check_same_thread=False,
+            timeout=DRIVE_CACHE_BUSY_TIMEOUT if timeout is None else timeout)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS drive_meta ('
+            'source_id TEXT PRIMARY KEY, name TEXT, size INTEGER, '
+            'fetched_at INTEGER NOT NULL)')
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS ix_drive_meta_fetched_at '
+            'ON drive_meta (fetched_at)')
+        self.conn.commit()
+
+    def get_many(self, source_ids):
+        """Return {source_id: file} of the fresh entries among source_ids"""
+        files = {}
+        fresh_after = int(time()) - self.ttl
+        source_ids = list(source_ids)
+        with self.lock:
+            try:
+                for offset in range(0, len(source_ids), CHUNK_SIZE):
+                    chunk = source_ids[offset:offset + CHUNK_SIZE]
+                    rows = self.conn.execute(
+                        'SELECT source_id, name, size FROM drive_meta '
+                        'WHERE fetched_at >= ? AND source_id IN ({})'.format(
+                            ','.join('?' * len(chunk))),
+                        [fresh_after] + chunk)
+                    for (source_id, name, size) in rows:
+                        files[source_id] = {'name': name, 'size': size}
+            except sqlite3.Error as exc:
+                LOGGER.info('Cache read failed, {} sources left to look '
+                            'up: {}'.format(len(source_ids) - len(files),
+                                            exc))
+        return files
+
+    def put_many(self, files):
+        if not files:
+            return
+        now = int(time())
+        with self.lock:
+            try:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO drive_meta '
+                    '(source_id, name, size, fetched_at) VALUES (?, ?, ?, ?)',
+                    [(source_id, file['name'], file['size'], now)
+                     for (source_id, file) in files.items()])
+                self.evict(now)
+                self.conn.commit()
+            except sqlite3.Error as exc:
+                self.conn.rollback()
+                LOGGER.info('Cache write of {} sources skipped: {}'.format(
+                    len(files), exc))
+
+    def evict(self, now):
+        self.conn.execute('DELETE FROM drive_meta WHERE fetched_at < ?',
+                          (now - self.ttl,))
+        (count,) = self.conn.execute(
+            'SELECT COUNT(*) FROM drive_meta').fetchone()
+        if count > self.max_entries:
+            self.conn.execute(
+                'DELETE FROM drive_meta WHERE source_id IN ('
+                'SELECT source_id FROM drive_meta '
+                'ORDER BY fetched_at ASC LIMIT ?)',
+                (count - self.max_entries,))
+
+    def close(self):
+        self.conn.close()
+
+
+class NullCache(object):
+    def get_many(self, source_ids):
+        return {}
+
+    def put_many(self, files):
+        pass
+
+    def close(self):
+        pass
+
+
+def open_cache():
+    if not DRIVE_CACHE_PATH:
+        return NullCache()
+    try:
+        return MetaCache(DRIVE_CACHE_PATH)
+    except sqlite3.Error as exc:
+        LOGGER.info('Cache {} unavailable, running without it: {}'.format(
+            DRIVE_CACHE_PATH, exc))
+        return NullCache()
@@ -0,0 +1,265 @@
+import os
+import json
+import bisect
+import logging
+import functools
+import threading
+from time import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from . import db
+
+"""
+Logging configuration
+"""
+LOG_FORMAT = ('%(levelname) -10s %(asctime)s %(name) -30s %(funcName) '
+              '-35s %(lineno) -5d: %(message)s')
+LOGGER = logging.getLogger(__name__)
+
+env = os.environ
+# directory of the node exporter textfile collector, the <job>.prom and
+# <job>.json of the last run are written there when set
+METRICS_DIR = env.get('METRICS_DIR')
+METRICS_PREFIX = env.get('METRICS_PREFIX', 'duongtang')
+# upper bounds, in seconds, of the HTTP latency histogram buckets
+HTTP_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+local = threading.local()
+watched_engines = set()
+
+
+class Histogram(object):
+    def __init__(self, buckets=HTTP_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for (bound, count) in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class Run(object):
+    """Everything measured during one run of a job"""
+
+    def __init__(self, job):
+        self.job = job
+        self.started = time()
+        self.took = None
+        self.success = None
+        self.lock = threading.Lock()
+        self.counters = {}
+        # verb: [statements, seconds, rows]
+        self.db = {}
+        # (endpoint, status): Histogram
+        self.http = {}
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe_statement(self, verb, seconds, rows):
+        with self.lock:
+            stats = self.db.setdefault(verb, [0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += seconds
+            if rows > 0:
+                stats[2] += rows
+
+    def observe_http(self, endpoint, status, seconds):
+        with self.lock:
+            key = (endpoint, str(status))
+            if key not in self.http:
+                self.http[key] = Histogram()
+            self.http[key].observe(seconds)
+
+    def summary(self):
+        return {
+            'job': self.job,
+            'started': self.started,
+            'took': self.took,
+            'success': self.success,
+            'counters': self.counters,
+            'db': {verb: {'statements': statements,
+                          'seconds': round(seconds, 6), 'rows': rows}
+                   for (verb, (statements, seconds, rows))
+                   in self.db.items()},
+            'http': [{'endpoint': endpoint, 'status': status,
+                      'count': histogram.count,
+                      'seconds': round(histogram.sum, 6)}
+                     for ((endpoint, status), histogram)
+                     in sorted(self.http.items())]
+        }
+
+    def textfile(self):
+        prefix = METRICS_PREFIX
+        job = 'job="{}"'.format(self.job)
+        lines = []
+
+        def gauge(name, help_text, samples):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, help_text))
+            lines.append('# TYPE {}_{} gauge'.format(prefix, name))
+            for (labels, value) in samples:
+                lines.append('{}_{}{{{}}} {}'.format(
+                    prefix, name, ','.join([job] + labels), value))
+
+        gauge('job_last_run_timestamp_seconds', 'Start of the last run.',
+              [([], self.started)])
+        gauge('job_duration_seconds', 'Duration of the last run.',
+              [([], self.took)])
+        gauge('job_success', 'Whether the last run finished without error.',
+              [([], int(bool(self.success)))])
+        gauge('job_items', 'Items counted by the last run.',
+              [(['name="{}"'.format(name)], value)
+               for (name, value) in sorted(self.counters.items())])
+        db_stats = sorted(self.db.items())
+        gauge('job_db_statements', 'SQL statements of the last run.',
+              [(['verb="{}"'.format(verb)], stats[0])
+               for (verb, stats) in db_stats])
+        gauge('job_db_seconds', 'Time spent in SQL statements.',
+              [(['verb="{}"'.format(verb)], round(stats[1], 6))
+               for (verb, stats) in db_stats])
+        gauge('job_db_rows', 'Rows returned or affected by SQL statements.',
+              [(['verb="{}"'.format(verb)], stats[2])
+               for (verb, stats) in db_stats])
+
+        name = '{}_job_http_request_seconds'.format(prefix)
+        lines.append('# HELP {} HTTP request latency of the last run.'.format(
+            name))
+        lines.append('# TYPE {} histogram'.format(name))
+        for ((endpoint, status), histogram) in sorted(self.http.items()):
+            labels = '{},endpoint="{}",status="{}"'.format(
+                job, endpoint, status)
+            for (bound, total) in histogram.cumulative():
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                    name, labels, bound, total))
+            lines.append('{}_sum{{{}}} {}'.format(
+                name, labels, round(histogram.sum, 6)))
+            lines.append('{}_count{{{}}} {}'.format(
+                name, labels, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+def current():
+    return getattr(local, 'run', None)
+
+
+def count(name, n=1):
+    """Add n to a counter of the current run, if any"""
+    run = getattr(local, 'run', None)
+    if run is not None:
+        run.count(name, n)
+
+
+def bind(fn):
+    """Make fn report to the calling thread's run when it is executed by
+    a worker thread
+    """
+    run = current()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        previous = getattr(local, 'run', None)
+        local.run = run
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            local.run = previous
+    return wrapper
+
+
+def http_hook(endpoint):
+    """A requests response hook recording the latency of every response
+    under endpoint and its status code
+    """
+    run = current()
+
+    def hook(response, *args, **kwargs):
+        target = getattr(local, 'run', None) or run
+        if target is not None:
+            target.observe_http(endpoint, response.status_code,
+                                response.elapsed.total_seconds())
+    return {'response': hook}
+
+
+"""
+Statement timing
+"""
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    if getattr(local, 'run', None) is not None:
+        conn.info['metrics_started'] = time()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    run = getattr(local, 'run', None)
+    started = conn.info.pop('metrics_started', None)
+    if run is None or started is None:
+        return
+    seconds = time() - started
+    verb = statement.lstrip().split(None, 1)[0].lower() if statement else ''
+    rows = cursor.rowcount
+    # unbuffered cursors do not know their row count yet, PyMySQL reports
+    # 2 ** 64 - 1 for them
+    if (context is not None and context.execution_options.get(
+            'stream_results')) or rows >= 2 ** 63:
+        rows = -1
+    run.observe_statement(verb, seconds, rows)
+
+
+def watch(engine):
+    if engine in watched_engines:
+        return
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    watched_engines.add(engine)
+
+
+def write(run, directory):
+    os.makedirs(directory, exist_ok=True)
+    for (extension, content) in (
+            ('prom', run.textfile()),
+            ('json', json.dumps(run.summary(), sort_keys=True))):
+        path = os.path.join(directory, '{}.{}'.format(run.job, extension))
+        # the collector must never read a half written file
+        with open(path + '.tmp', 'w') as f:
+            f.write(content)
+        os.replace(path + '.tmp', path)
+
+
+@contextmanager
+def track(job):
+    """Measure the block as one run of job, then export it"""
+    watch(db.engine)
+    run = Run(job)
+    previous = getattr(local, 'run', None)
+    local.run = run
+    try:
+        yield run
+        run.success = True
+    except BaseException:
+        run.success = False
+        raise
+    finally:
+        local.run = previous
+        run.took = time() - run.started
+        LOGGER.info('Metrics: {}'.format(json.dumps(run.summary(),
+                                                    sort_keys=True)))
+        if METRICS_DIR:
+            try:
+                write(run, METRICS_DIR)
+            except OSError as exc:
+                LOGGER.info('Error: {}'.format(exc))
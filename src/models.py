@@ -1,9 +1,16 @@
 from datetime import datetime
+from sqlalchemy.dialects.mysql import TINYINT
 from . import db
 
 
 class Config(db.Model):
     __tablename__ = 'configs'
+    __table_args__ = (
+        db.Index('ix_configs_key_status_expires', 'key', 'status',
+                 'expires'),
+        db.Index('ix_configs_key_status_updated_timestamp',
+                 'key', 'status', 'updated_timestamp'),
+    )
 
     ACTIVE_STATUS = 1
     INACTIVE_STATUS = 0
@@ -16,10 +23,70 @@ class Config(db.Model):
     status = db.Column(db.Integer, default=ACTIVE_STATUS)
     expires = db.Column(db.Integer, nullable=True)
     updated_date = db.Column(db.DateTime, onupdate=datetime.utcnow)
+    updated_timestamp = db.Column(db.BigInteger, nullable=True)
+
+
+class Stream(db.Model):
+    __tablename__ = 'streams'
+    __table_args__ = (
+        db.Index('ix_streams_status_code_next_check_at',
+                 'status_code', 'next_check_at'),
+        db.Index('ix_streams_updated_meta_meta_lease_until',
+                 'updated_meta', 'meta_lease_until'),
+        db.Index('ix_streams_meta_lease_owner', 'meta_lease_owner'),
+        # expired rows for clean_stream. A one character prefix of result
+        # is enough to tell NULL apart.
+        db.Index('ix_streams_result_created_date', 'result', 'created_date',
+                 mysql_length={'result': 1}),
+        # utf8 index keys are limited to 767 bytes
+        db.Index('ix_streams_source_id', 'source_id',
+                 mysql_length=191),
+    )
+
+    STATUS_CODE = {
+        'ACTIVE': 200,
+        'DIE': 404,
+        'NOT_PERM': 401
+    }
+
+    STATUS_CODE_ACTIVE = 200
+    STATUS_CODE_DIE = 404
+    STATUS_CODE_NOT_PERM = 401
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    source_id = db.Column(db.String(256), nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    source_type = db.Column(db.String(128), nullable=False)
+    type = db.Column(db.String(128), nullable=True, default='photo')
+    result = db.Column(db.Text, nullable=True)
+    email = db.Column(db.String(128), nullable=True)
+    expired = db.Column(db.Integer, nullable=True)
+    duration = db.Column(db.Integer, nullable=True)
+    title = db.Column(db.String(255), nullable=True)
+    size = db.Column(db.Integer, nullable=True)
+    status_code = db.Column(db.Integer, nullable=True, default=200)
+    created_date = db.Column(db.DateTime, nullable=True,
+                             default=datetime.utcnow)
+    updated_date = db.Column(db.DateTime, onupdate=datetime.utcnow)
+    deleted_date = db.Column(db.DateTime, nullable=True, default=None)
+    updated_meta = db.Column(TINYINT, nullable=True, default=False)
+    # re-verification schedule of 403 streams, see verify_stream_result
+    next_check_at = db.Column(db.Integer, nullable=True)
+    # the API inserts streams without it
+    check_attempts = db.Column(db.Integer, nullable=False, default=0,
+                               server_default='0')
+    # metadata work claimed by an update_drive_info worker until then
+    meta_lease_owner = db.Column(db.String(64), nullable=True)
+    meta_lease_until = db.Column(db.Integer, nullable=True)
 
 
 class BalanceLog(db.Model):
     __tablename__ = 'balance_logs'
+    __table_args__ = (
+        db.Index('ix_balance_logs_user_id_id', 'user_id', 'id'),
+        db.Index('ix_balance_logs_transaction_type_transaction_timestamp',
+                 'transaction_type', 'transaction_timestamp'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, nullable=False)
@@ -33,9 +100,122 @@ class UserBalance2(db.Model):
     __tablename__ = 'user_balance_2'
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    user_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False, unique=True)
     balance = db.Column(db.Integer, nullable=True, default=0)
     last_id = db.Column(db.Integer, nullable=False)
     created_date = db.Column(db.DateTime, nullable=True,
                              default=datetime.utcnow)
     updated_date = db.Column(db.DateTime, onupdate=datetime.utcnow)
+
+
+class Watermark(db.Model):
+    __tablename__ = 'job_watermarks'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    name = db.Column(db.String(128), nullable=False, unique=True)
+    last_id = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_date = db.Column(db.DateTime, default=datetime.utcnow,
+                             onupdate=datetime.utcnow)
+
+
+class JobLease(db.Model):
+    __tablename__ = 'job_leases'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    name = db.Column(db.String(128), nullable=False, unique=True)
+    # host:pid:token of the running instance, NULL when nobody runs it
+    holder = db.Column(db.String(64), nullable=True)
+    started_at = db.Column(db.Integer, nullable=True)
+    heartbeat_at = db.Column(db.Integer, nullable=True)
+    expires_at = db.Column(db.Integer, nullable=True)
+    finished_at = db.Column(db.Integer, nullable=True)
+    progress = db.Column(db.String(255), nullable=True)
+
+
+class ReportEarning(db.Model):
+    __tablename__ = 'report_earning'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    date = db.Column(db.Integer, nullable=False, unique=True)
+    total_req = db.Column(db.Integer, nullable=False, default=0)
+    total_earn = db.Column(db.Integer, nullable=False, default=0)
+    total_view = db.Column(db.Integer, nullable=False, default=0)
+    total_view_earn = db.Column(db.Integer, nullable=False, default=0)
+    total_upload = db.Column(db.Integer, nullable=False, default=0)
+    total_upload_earn = db.Column(db.Integer, nullable=False, default=0)
+    total_export = db.Column(db.Integer, nullable=False, default=0)
+    total_export_earn = db.Column(db.Integer, nullable=False, default=0)
+    created_date = db.Column(db.DateTime, nullable=True,
+                             default=datetime.utcnow)
+    updated_date = db.Column(db.DateTime, onupdate=datetime.utcnow)
+
+
+class ReportEarningHourly(db.Model):
+    __tablename__ = 'report_earning_hourly'
+    __table_args__ = (db.UniqueConstraint('hour', 'transaction_type'),)
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # unix hour: transaction_timestamp // 3600000000
+    hour = db.Column(db.Integer, nullable=False)
+    transaction_type = db.Column(db.String(32), nullable=False)
+    total_req = db.Column(db.Integer, nullable=False, default=0)
+    total_earn = db.Column(db.Integer, nullable=False, default=0)
+    created_date = db.Column(db.DateTime, nullable=True,
+                             default=datetime.utcnow)
+    updated_date = db.Column(db.DateTime, onupdate=datetime.utcnow)
+
+
+class ReportEarningUser(db.Model):
+    __tablename__ = 'report_earning_users'
+    __table_args__ = (db.UniqueConstraint('date', 'user_id'),)
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    date = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    total_req = db.Column(db.Integer, nullable=False, default=0)
+    total_earn = db.Column(db.Integer, nullable=False, default=0)
+    total_view = db.Column(db.Integer, nullable=False, default=0)
+    total_view_earn = db.Column(db.Integer, nullable=False, default=0)
+    total_upload = db.Column(db.Integer, nullable=False, default=0)
+    total_upload_earn = db.Column(db.Integer, nullable=False, default=0)
+    total_export = db.Column(db.Integer, nullable=False, default=0)
+    total_export_earn = db.Column(db.Integer, nullable=False, default=0)
+    created_date = db.Column(db.DateTime, nullable=True,
+                             default=datetime.utcnow)
+    updated_date = db.Column(db.DateTime, onupdate=datetime.utcnow)
+
+
+class ReportEarningSource(db.Model):
+    __tablename__ = 'report_earning_sources'
+    __table_args__ = (db.UniqueConstraint('date', 'rank'),)
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    date = db.Column(db.Integer, nullable=False)
+    # 1 for the source earning the most that day
+    rank = db.Column(db.Integer, nullable=False)
+    source_id = db.Column(db.String(255), nullable=False)
+    total_req = db.Column(db.Integer, nullable=False, default=0)
+    total_earn = db.Column(db.Integer, nullable=False, default=0)
+    total_view = db.Column(db.Integer, nullable=False, default=0)
+    total_view_earn = db.Column(db.Integer, nullable=False, default=0)
+    total_upload = db.Column(db.Integer, nullable=False, default=0)
+    total_upload_earn = db.Column(db.Integer, nullable=False, default=0)
+    total_export = db.Column(db.Integer, nullable=False, default=0)
+    total_export_earn = db.Column(db.Integer, nullable=False, default=0)
+    created_date = db.Column(db.DateTime, nullable=True,
+                             default=datetime.utcnow)
+    updated_date = db.Column(db.DateTime, onupdate=datetime.utcnow)
+
+
+class JobFailure(db.Model):
+    __tablename__ = 'job_failures'
+    __table_args__ = (db.UniqueConstraint('job', 'item_id'),)
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    job = db.Column(db.String(64), nullable=False)
+    item_id = db.Column(db.Integer, nullable=False)
+    retries = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.String(255), nullable=True)
+    created_date = db.Column(db.DateTime, nullable=True,
+                             default=datetime.utcnow)
+    updated_date = db.Column(db.DateTime, onupdate=datetime.utcnow)
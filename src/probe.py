@@ -0,0 +1,116 @@
+import os
+import logging
+import threading
+import concurrent.futures
+from time import time
+from collections import defaultdict, deque
+from urllib.parse import urlsplit
+
+import requests
+
+from . import metrics
+
+LOGGER = logging.getLogger(__name__)
+
+env = os.environ
+# requests in flight at once, overall and per host
+PROBE_CONCURRENCY = int(env.get('PROBE_CONCURRENCY', 32))
+PROBE_PER_HOST = int(env.get('PROBE_PER_HOST', 4))
+# seconds allowed to a single request and to the whole run
+PROBE_TIMEOUT = float(env.get('PROBE_TIMEOUT', 15))
+PROBE_DEADLINE = float(env.get('PROBE_DEADLINE', 240))
+
+
+class ProbeDeadlineError(Exception):
+    pass
+
+
+def host_of(url):
+    return urlsplit(url or '').netloc
+
+
+def interleave_hosts(items, url_of):
+    """Order items round-robin across hosts, so the workers are not all
+    parked on the semaphore of one busy host
+    """
+    by_host = defaultdict(deque)
+    for item in items:
+        by_host[host_of(url_of(item))].append(item)
+    queues = deque(by_host.values())
+    while queues:
+        queue = queues.popleft()
+        yield queue.popleft()
+        if queue:
+            queues.append(queue)
+
+
+class Prober(object):
+    def __init__(self, headers=None, concurrency=None, per_host=None,
+                 timeout=None, deadline=None):
+        self.headers = headers
+        self.concurrency = concurrency or PROBE_CONCURRENCY
+        self.per_host = per_host or PROBE_PER_HOST
+        self.timeout = timeout or PROBE_TIMEOUT
+        self.deadline = time() + (deadline or PROBE_DEADLINE)
+        self.lock = threading.Lock()
+        self.hosts = {}
+        self.local = threading.local()
+
+    def semaphore(self, host):
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self.hosts[host]
+
+    def http(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def remaining(self):
+        remaining = self.deadline - time()
+        if remaining <= 0:
+            raise ProbeDeadlineError()
+        return remaining
+
+    def head(self, url):
+        semaphore = self.semaphore(host_of(url))
+        if not semaphore.acquire(timeout=self.remaining()):
+            raise ProbeDeadlineError()
+        try:
+            res = self.http().head(url, headers=self.headers, timeout=min(
+                self.timeout, self.remaining()),
+                hooks=metrics.http_hook('stream_probe'))
+            return res.status_code
+        finally:
+            semaphore.release()
+
+    def probe_all(self, items, url_of):
+        """Return (item, status_code, error) for every item, in input order.
+        Items not probed before the run deadline get a ProbeDeadlineError.
+        """
+        pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix='probe')
+        futures = {}
+        for item in interleave_hosts(items, url_of):
+            futures[id(item)] = pool.submit(metrics.bind(self.head),
+                                           url_of(item))
+        (_, not_done) = concurrent.futures.wait(
+            futures.values(), timeout=max(0, self.deadline - time()))
+        for future in not_done:
+            future.cancel()
+        pool.shutdown(wait=False)
+
+        outcomes = []
+        for item in items:
+            future = futures[id(item)]
+            if future in not_done:
+                outcomes.append((item, None, ProbeDeadlineError()))
+                continue
+            try:
+                outcomes.append((item, future.result(), None))
+            except Exception as exc:
+                outcomes.append((item, None, exc))
+        LOGGER.info('Probed {} urls, {} past deadline'.format(
+            len(items), len(not_done)))
+        return outcomes
@@ -0,0 +1,181 @@
+import io
+import os
+import sys
+import pstats
+import cProfile
+import logging
+import threading
+from time import time, strftime
+from collections import Counter
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from . import db
+
+"""
+Logging configuration
+"""
+LOG_FORMAT = ('%(levelname) -10s %(asctime)s %(name) -30s %(funcName) '
+              '-35s %(lineno) -5d: %(message)s')
+LOGGER = logging.getLogger(__name__)
+
+env = os.environ
+# `cprofile` profiles the thread running the job, `sample` takes stacks of
+# every thread each PROFILE_INTERVAL seconds; off when empty
+PROFILE_MODE = env.get('PROFILE_MODE', '')
+PROFILE_DIR = env.get('PROFILE_DIR', '/tmp/duongtang-profiles')
+PROFILE_INTERVAL = float(env.get('PROFILE_INTERVAL', 0.01))
+# functions of a cProfile run logged, by PROFILE_SORT
+PROFILE_TOP = int(env.get('PROFILE_TOP', 25))
+PROFILE_SORT = env.get('PROFILE_SORT', 'cumulative')
+# seconds, statements slower than that are logged with an EXPLAIN; off
+# when empty
+SLOW_QUERY_SECONDS = env.get('SLOW_QUERY_SECONDS', '')
+# characters of the statement parameters logged
+SLOW_QUERY_MAX_PARAMS = int(env.get('SLOW_QUERY_MAX_PARAMS', 500))
+
+EXPLAINABLE = ('select', 'update', 'delete', 'insert', 'replace')
+
+watched_engines = set()
+
+
+def profile_path(job, extension):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    return os.path.join(PROFILE_DIR, '{}-{}-{}.{}'.format(
+        job, strftime('%Y%m%dT%H%M%S'), os.getpid(), extension))
+
+
+class Sampler(threading.Thread):
+    """Count the stacks of every other thread, in the collapsed format
+    flamegraph.pl and speedscope read
+    """
+
+    def __init__(self, interval):
+        super().__init__(name='sampler', daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopping = threading.Event()
+
+    def run(self):
+        me = threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            for (ident, frame) in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{} ({}:{})'.format(
+                        code.co_name, os.path.basename(code.co_filename),
+                        code.co_firstlineno))
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for (stack, count) in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+@contextmanager
+def sampled(job):
+    sampler = Sampler(PROFILE_INTERVAL)
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        path = profile_path(job, 'folded')
+        sampler.dump(path)
+        LOGGER.info('{} samples of {} written to {}'.format(
+            sum(sampler.stacks.values()), job, path))
+
+
+@contextmanager
+def cprofiled(job):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = profile_path(job, 'prof')
+        profiler.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats(
+            PROFILE_SORT).print_stats(PROFILE_TOP)
+        LOGGER.info('Profile of {} written to {}\n{}'.format(
+            job, path, out.getvalue()))
+
+
+"""
+Slow queries
+"""
+
+
+def explain(conn, statement, parameters):
+    prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' \
+        else 'EXPLAIN '
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def watch_slow_queries(engine, threshold):
+    if engine in watched_engines:
+        return
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        conn.info['profiling_started'] = time()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context,
+                             executemany):
+        started = conn.info.pop('profiling_started', None)
+        took = time() - (started or 0)
+        if started is None or took < threshold:
+            return
+        params = repr(parameters)
+        if len(params) > SLOW_QUERY_MAX_PARAMS:
+            params = params[:SLOW_QUERY_MAX_PARAMS] + '...'
+        plan = None
+        verb = statement.lstrip().split(None, 1)[0].lower()
+        # a streamed result still owns the connection
+        streaming = context is not None and \
+            context.execution_options.get('stream_results')
+        if verb in EXPLAINABLE and not executemany and not streaming:
+            try:
+                plan = explain(conn, statement, parameters)
+            except Exception as exc:
+                plan = 'EXPLAIN failed: {}'.format(exc)
+        LOGGER.info('Slow query took {:.3f}s: {}\nParameters: {}\n'
+                    'Plan: {}'.format(took, statement, params, plan))
+
+    watched_engines.add(engine)
+
+
+@contextmanager
+def profiled(job):
+    """Profile the block as one run of job, if PROFILE_MODE asks to, and log
+    slow statements, if SLOW_QUERY_SECONDS is set. Does nothing otherwise.
+    """
+    if SLOW_QUERY_SECONDS:
+        watch_slow_queries(db.engine, float(SLOW_QUERY_SECONDS))
+    if PROFILE_MODE == 'cprofile':
+        with cprofiled(job):
+            yield
+    elif PROFILE_MODE == 'sample':
+        with sampled(job):
+            yield
+    else:
+        yield
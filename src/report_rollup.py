@@ -0,0 +1,120 @@
+import os
+import logging
+from time import time
+from datetime import datetime
+
+from sqlalchemy import Integer, func, null
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.sql.functions import sum, count, max
+from sqlalchemy.sql.expression import cast
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import entry
+from .batch import BatchLoop
+from .db import session
+from .models import BalanceLog, ReportEarningHourly
+from .watermark import (get_watermark, lock_watermark, set_watermark,
+                        settled_ledger_id)
+
+"""
+Logging configuration
+"""
+LOG_FORMAT = ('%(levelname) -10s %(asctime)s %(name) -30s %(funcName) '
+              '-35s %(lineno) -5d: %(message)s')
+logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+LOGGER = logging.getLogger(__name__)
+
+env = os.environ
+# ledger ids in the first chunk, later ones are sized to BATCH_TARGET_SECONDS
+ROLLUP_CHUNK_SIZE = int(env.get('ROLLUP_CHUNK_SIZE', 50000))
+WATERMARK_NAME = 'report_rollup'
+# transaction_timestamp is in microseconds
+HOUR = 3600 * 1000000
+
+
+def hour_of(timestamp):
+    return timestamp // HOUR
+
+
+def get_last_ledger_id():
+    return session.query(max(BalanceLog.id)).scalar() or 0
+
+
+def hourly_chunk(low_id, high_id):
+    hour = cast(func.floor(BalanceLog.transaction_timestamp / HOUR), Integer)
+    return session.query(BalanceLog).with_entities(
+        hour.label('hour'),
+        BalanceLog.transaction_type,
+        count(BalanceLog.id).label('total_req'),
+        cast((sum(BalanceLog.balance) * -1), Integer).label('total_earn')
+    ).filter(
+        BalanceLog.id > low_id,
+        BalanceLog.id <= high_id,
+        BalanceLog.transaction_type.isnot(None)
+    ).group_by(hour, BalanceLog.transaction_type).order_by(null())
+
+
+def sum_hourly_chunk(low_id, high_id):
+    return hourly_chunk(low_id, high_id).all()
+
+
+def update_hourly_buckets(buckets):
+    if not buckets:
+        return
+    table = ReportEarningHourly.__table__
+    now = datetime.utcnow()
+    stmt = insert(table).values([{
+        'hour': hour,
+        'transaction_type': transaction_type,
+        'total_req': req,
+        'total_earn': earn or 0,
+        'created_date': now
+    } for (hour, transaction_type, req, earn) in buckets])
+    stmt = stmt.on_duplicate_key_update(
+        total_req=table.c.total_req + stmt.inserted.total_req,
+        total_earn=table.c.total_earn + stmt.inserted.total_earn,
+        updated_date=now
+    )
+    session.execute(stmt)
+
+
+def rollup_batch(size):
+    """Fold the next `size` ledger ids past the watermark into hourly
+    buckets, returning how many ids it moved over
+    """
+    try:
+        low_id = lock_watermark(WATERMARK_NAME)
+        high_id = settled_ledger_id(
+            low_id, min(low_id + size, get_last_ledger_id()))
+        if low_id >= high_id:
+            session.rollback()
+            return 0
+        buckets = sum_hourly_chunk(low_id, high_id)
+        update_hourly_buckets(buckets)
+        set_watermark(WATERMARK_NAME, high_id)
+        session.commit()
+        LOGGER.info('Rolled up ledger ids ({}, {}] into {} buckets'.format(
+            low_id, high_id, len(buckets)))
+        return high_id - low_id
+    except SQLAlchemyError as exc:
+        LOGGER.info('Error: {}'.format(exc))
+        session.rollback()
+        return 0
+
+
+def execute():
+    """Fold every balance_logs row past the watermark into hourly buckets"""
+    BatchLoop(WATERMARK_NAME, ROLLUP_CHUNK_SIZE).run(
+        lambda size, deadline: rollup_batch(size),
+        backlog=lambda: get_last_ledger_id() - get_watermark(WATERMARK_NAME))
+
+
+@entry.job('report_rollup')
+def main():
+    ts = time()
+    execute()
+    LOGGER.info('Took {}'.format(time() - ts))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,20 @@
+import os
 import logging
-from time import time
-from sqlalchemy import Integer
-from sqlalchemy.exc import SQLAlchemyError
+import multiprocessing
+import concurrent.futures
+from time import sleep, time
+from datetime import datetime
+from sqlalchemy import Integer, func, null
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from sqlalchemy.dialects.mysql import insert
 from sqlalchemy.sql.functions import sum, max
 from sqlalchemy.sql.expression import cast
+from . import db, entry, metrics
+from .batch import BatchLoop
 from .db import session
 from .models import BalanceLog, UserBalance2
+from .watermark import (get_watermark, lock_watermark, set_watermark,
+                        settled_ledger_id)
 
 """
 Logging configuration
@@ -14,15 +23,37 @@ LOG_FORMAT = ('%(levelname) -10s %(asctime)s %(name) -30s: %(message)s')
 logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
+env = os.environ
+# `watermark` folds every new ledger row past a global id watermark chunk
+# by chunk. `recent` walks the 100 most recently active users one by one,
+# sorting the whole ledger to find them, and is kept for databases where
+# user_balance_2 has no unique key on user_id yet.
+UPDATE_BALANCE_MODE = env.get('UPDATE_BALANCE_MODE', 'watermark')
+# ledger ids in the first chunk, later ones are sized to BATCH_TARGET_SECONDS
+BALANCE_CHUNK_SIZE = int(env.get('BALANCE_CHUNK_SIZE', 10000))
+# Worker processes upserting each chunk of the watermark mode. A chunk is
+# read once, then split into `user_id % BALANCE_SHARDS` shards so every
+# worker owns disjoint user_balance_2 rows and commits them on its own.
+BALANCE_SHARDS = int(env.get('BALANCE_SHARDS', 1))
+# attempts of a batch hitting a deadlock or a lock wait timeout, the
+# upserts of concurrent shards can lock the same gaps of user_balance_2
+BALANCE_BATCH_ATTEMPTS = int(env.get('BALANCE_BATCH_ATTEMPTS', 3))
+# MySQL error codes of a deadlock and of a lock wait timeout
+RETRIED_ERRORS = (1213, 1205)
+WATERMARK_NAME = 'update_balance'
+
+
+def recent_active_users():
+    query = session.query(BalanceLog).with_entities(
+        BalanceLog.user_id)
+    query = query.order_by(BalanceLog.transaction_timestamp.desc())
+    query = query.group_by(BalanceLog.user_id)
+    return query.limit(100)
+
 
 def get_recent_active_users():
     try:
-        query = session.query(BalanceLog).with_entities(
-            BalanceLog.user_id)
-        query = query.order_by(BalanceLog.transaction_timestamp.desc())
-        query = query.group_by(BalanceLog.user_id)
-        query = query.limit(100)
-        return query.all()
+        return recent_active_users().all()
     except SQLAlchemyError as err:
         logger.error("get recent active user error: {}".format(err))
 
@@ -33,15 +64,19 @@ def get_user_balance(user_id):
         user_id=user_id).first()
 
 
-def sum_user_balance(user_id, last_id=0):
-    logger.info('sum user balance for user_id {}'.format(user_id))
+def user_balance_since(user_id, last_id=0):
     return session.query(BalanceLog).with_entities(
         cast(sum(BalanceLog.balance), Integer).label('total_balance'),
         max(BalanceLog.id).label('last_id')
     ).filter(
         BalanceLog.id > last_id,
         BalanceLog.user_id == user_id
-    ).first()
+    )
+
+
+def sum_user_balance(user_id, last_id=0):
+    logger.info('sum user balance for user_id {}'.format(user_id))
+    return user_balance_since(user_id, last_id).first()
 
 
 def update_user_balance(user_id, balance, last_id):
@@ -64,7 +99,145 @@ def update_user_balance(user_id, balance, last_id):
         session.rollback()
 
 
-def execute():
+def get_last_ledger_id():
+    return session.query(max(BalanceLog.id)).scalar() or 0
+
+
+def balance_chunk(low_id, high_id):
+    """Sum the ledger rows in (low_id, high_id] per user, skipping rows
+    already folded into user_balance_2 by its per-user last_id.
+    """
+    query = session.query(BalanceLog).with_entities(
+        BalanceLog.user_id,
+        cast(sum(BalanceLog.balance), Integer).label('total_balance'),
+        max(BalanceLog.id).label('last_id')
+    ).outerjoin(
+        UserBalance2, UserBalance2.user_id == BalanceLog.user_id
+    ).filter(
+        BalanceLog.id > low_id,
+        BalanceLog.id <= high_id,
+        BalanceLog.id > func.coalesce(UserBalance2.last_id, 0)
+    )
+    # ORDER BY NULL spares MySQL 5.x the implicit sort of the GROUP BY
+    return query.group_by(BalanceLog.user_id).order_by(null())
+
+
+def sum_balance_chunk(low_id, high_id):
+    return balance_chunk(low_id, high_id).all()
+
+
+def update_user_balances(balances):
+    """Apply every (user_id, balance, last_id) delta with one upsert"""
+    if not balances:
+        return
+    table = UserBalance2.__table__
+    now = datetime.utcnow()
+    # every shard locks its users in the same order
+    balances = sorted(balances)
+    stmt = insert(table).values([{
+        'user_id': user_id,
+        'balance': balance or 0,
+        'last_id': last_id,
+        'created_date': now
+    } for (user_id, balance, last_id) in balances])
+    stmt = stmt.on_duplicate_key_update(
+        balance=func.coalesce(table.c.balance, 0) + stmt.inserted.balance,
+        last_id=func.greatest(table.c.last_id, stmt.inserted.last_id),
+        updated_date=now
+    )
+    session.execute(stmt)
+
+
+def retried(err):
+    return isinstance(err, OperationalError) and bool(err.orig.args) \
+        and err.orig.args[0] in RETRIED_ERRORS
+
+
+def split_shards(balances, shards):
+    """Split the (user_id, balance, last_id) deltas of a chunk into the
+    non-empty `user_id % shards` shards
+    """
+    parts = [[] for _ in range(shards)]
+    for (user_id, balance, last_id) in balances:
+        parts[user_id % shards].append((user_id, balance, last_id))
+    return [part for part in parts if part]
+
+
+def apply_shard(balances):
+    """Upsert one shard of a chunk in its own transaction, in a worker
+    process. The last_id of its users keeps the rows from being folded
+    twice when the chunk is read again before the watermark moves.
+    """
+    try:
+        update_user_balances(balances)
+        session.commit()
+    except SQLAlchemyError:
+        session.rollback()
+        raise
+
+
+def apply_balances(balances, pool=None):
+    if pool is None:
+        # in the transaction moving the watermark
+        update_user_balances(balances)
+        return
+    futures = [pool.submit(apply_shard, shard)
+               for shard in split_shards(balances, BALANCE_SHARDS)]
+    for future in futures:
+        future.result()
+
+
+def balance_batch(size, pool=None):
+    """Fold the next `size` ledger ids past the watermark, returning how
+    many ids it moved over. Deadlocks are retried; an error left after
+    BALANCE_BATCH_ATTEMPTS is raised, as 0 would read as a drained ledger.
+    """
+    for attempt in range(1, BALANCE_BATCH_ATTEMPTS + 1):
+        try:
+            low_id = lock_watermark(WATERMARK_NAME)
+            high_id = settled_ledger_id(
+                low_id, min(low_id + size, get_last_ledger_id()))
+            if low_id >= high_id:
+                session.rollback()
+                return 0
+            balances = sum_balance_chunk(low_id, high_id)
+            apply_balances(balances, pool)
+            set_watermark(WATERMARK_NAME, high_id)
+            session.commit()
+            logger.info('applied ledger ids ({}, {}] to {} users'.format(
+                low_id, high_id, len(balances)))
+            return high_id - low_id
+        except SQLAlchemyError as err:
+            logger.error('update balance chunk error {}'.format(err))
+            session.rollback()
+            if not retried(err) or attempt == BALANCE_BATCH_ATTEMPTS:
+                raise
+            metrics.count('balance_batch_retries')
+            sleep(attempt)
+
+
+def shard_pool(shards):
+    # spawned rather than forked: the lease heartbeat, and under the daemon
+    # other jobs, run in threads whose held locks a fork would copy
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=shards, mp_context=multiprocessing.get_context('spawn'))
+
+
+def execute_watermark(shards=1):
+    # without it every upsert adds a row per user, counted twice after
+    db.require_unique_key(UserBalance2.__tablename__, ['user_id'])
+    name = WATERMARK_NAME
+    pool = shard_pool(shards) if shards > 1 else None
+    try:
+        BatchLoop(name, BALANCE_CHUNK_SIZE).run(
+            lambda size, deadline: balance_batch(size, pool),
+            backlog=lambda: get_last_ledger_id() - get_watermark(name))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def execute_recent():
     active_users = get_recent_active_users()
     for user in active_users:
         curr_balance = get_user_balance(user.user_id)
@@ -75,6 +248,14 @@ def execute():
             update_user_balance(user.user_id, new_balance, last_id)
 
 
+def execute(shards=None):
+    if UPDATE_BALANCE_MODE == 'recent':
+        execute_recent()
+    else:
+        execute_watermark(shards or BALANCE_SHARDS)
+
+
+@entry.job('update_balance')
 def main():
     ts = time()
     execute()
@@ -0,0 +1,55 @@
+import os
+from time import time
+from datetime import datetime
+from sqlalchemy.dialects.mysql import insert
+from .db import session
+from .models import BalanceLog, Watermark
+
+env = os.environ
+# seconds a ledger row must be old before a watermark moves past it. Ids
+# are taken at insert but rows show up at commit, so a chunk ending at
+# MAX(id) would skip for good the rows of a transaction still open.
+WATERMARK_SETTLE_SECONDS = int(env.get('WATERMARK_SETTLE_SECONDS', 60))
+
+
+def lock_watermark(name):
+    """Return the last processed id stored under `name`, locking the row
+    until the current transaction ends so concurrent runs are serialized.
+    """
+    session.execute(insert(Watermark.__table__).prefix_with('IGNORE').values(
+        name=name, last_id=0, updated_date=datetime.utcnow()))
+    return session.query(Watermark.last_id).filter_by(
+        name=name).with_for_update().scalar()
+
+
+def get_watermark(name):
+    last_id = session.query(Watermark.last_id).filter_by(name=name).scalar()
+    return last_id or 0
+
+
+def set_watermark(name, last_id):
+    """Move the watermark forward. The caller commits, so the new value is
+    persisted atomically with the work it covers.
+    """
+    session.query(Watermark).filter_by(name=name).update({
+        'last_id': last_id,
+        'updated_date': datetime.utcnow()
+    }, synchronize_session=False)
+
+
+def settled_ledger_ids(low_id, high_id, before):
+    # walks the primary key down from high_id to the first settled row
+    return session.query(BalanceLog.id).filter(
+        BalanceLog.id > low_id,
+        BalanceLog.id <= high_id,
+        BalanceLog.transaction_timestamp < before
+    ).order_by(BalanceLog.id.desc()).limit(1)
+
+
+def settled_ledger_id(low_id, high_id):
+    """Return the highest ledger id in (low_id, high_id] of a row older
+    than WATERMARK_SETTLE_SECONDS, or low_id when there is none
+    """
+    # transaction_timestamp is in microseconds
+    before = int((time() - WATERMARK_SETTLE_SECONDS) * 1000000)
+    return settled_ledger_ids(low_id, high_id, before).scalar() or low_id
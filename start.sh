@@ -1,5 +1,15 @@
 #!/bin/sh
 
+# bring the schema to src/models.py before any job runs on it
+if test "$MIGRATE"; then
+    python -m src.indexes apply || exit 1
+fi
+
+# run every cron in one long-lived process instead of one per invocation
+if test "$DAEMON"; then
+    exec python -m src.daemon
+fi
+
 if test "$CRON_NAME"; then
     cp "crons/$CRON_NAME" /etc/crontabs/root
     chown root:root /etc/crontabs/root
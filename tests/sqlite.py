@@ -0,0 +1,25 @@
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from src import db
+
+
+class SqliteTestCase(unittest.TestCase):
+    """Binds the job session to an in-memory sqlite database holding
+    `tables` for every test. MySQL-only statements still need a mock.
+    """
+    tables = ()
+
+    def setUp(self):
+        self.engine = create_engine(
+            'sqlite://', poolclass=StaticPool,
+            connect_args={'check_same_thread': False})
+        db.Model.metadata.create_all(self.engine, tables=list(self.tables))
+        db.session.remove()
+        db.session.configure(bind=self.engine)
+
+    def tearDown(self):
+        db.session.remove()
+        db.session.configure(bind=db.engine)
@@ -0,0 +1,32 @@
+import unittest
+
+from src.batch import BatchLoop
+
+
+class NextSizeTest(unittest.TestCase):
+    def loop(self, size=100):
+        return BatchLoop('test', size, budget=240, target=20)
+
+    def test_first_batch_keeps_the_size(self):
+        self.assertEqual(self.loop().next_size(None, 240), 100)
+
+    def test_grows_at_most_twofold(self):
+        self.assertEqual(self.loop().next_size(0.001, 240), 200)
+
+    def test_shrinks_at_most_by_half(self):
+        self.assertEqual(self.loop().next_size(10, 10000), 50)
+
+    def test_sized_to_the_target(self):
+        self.assertEqual(self.loop().next_size(0.125, 240), 160)
+
+    def test_last_batch_ends_in_time(self):
+        self.assertEqual(self.loop().next_size(0.1, 3), 30)
+
+    def test_capped_by_max_size(self):
+        loop = self.loop()
+        loop.size = loop.max_size
+        self.assertEqual(loop.next_size(0, 240), loop.max_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
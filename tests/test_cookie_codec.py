@@ -0,0 +1,70 @@
+import unittest
+
+from src.cookie_codec import (expires_at, merge_cookie, parse_set_cookie,
+                              split_headers)
+
+HEADERS = ('NID=188=abc; expires=Wed, 21-Oct-2026 07:28:00 GMT; path=/; '
+           'HttpOnly, SIDCC=AN0-x; Max-Age=3600; Secure')
+
+
+class SplitHeadersTest(unittest.TestCase):
+    def test_expires_comma_is_kept(self):
+        self.assertEqual(split_headers(HEADERS), [
+            'NID=188=abc; expires=Wed, 21-Oct-2026 07:28:00 GMT; path=/; '
+            'HttpOnly',
+            'SIDCC=AN0-x; Max-Age=3600; Secure'])
+
+    def test_list_of_headers(self):
+        self.assertEqual(split_headers(['A=1; path=/', 'B=2, C=3']),
+                         ['A=1; path=/', 'B=2', 'C=3'])
+
+
+class ParseSetCookieTest(unittest.TestCase):
+    def test_names_values_and_attributes(self):
+        self.assertEqual(parse_set_cookie(HEADERS), [
+            ('NID', '188=abc', {'expires': 'Wed, 21-Oct-2026 07:28:00 GMT',
+                                'path': '/', 'httponly': None}),
+            ('SIDCC', 'AN0-x', {'max-age': '3600', 'secure': None})])
+
+    def test_cookie_without_value_is_skipped(self):
+        self.assertEqual(parse_set_cookie('garbage; path=/'), [])
+
+
+class ExpiresAtTest(unittest.TestCase):
+    def test_max_age_first(self):
+        self.assertEqual(expires_at({'max-age': '3600', 'expires':
+                                     'Wed, 21-Oct-2026 07:28:00 GMT'}, 100),
+                         3700)
+
+    def test_netscape_and_rfc1123_dates(self):
+        self.assertEqual(
+            expires_at({'expires': 'Wed, 21-Oct-2026 07:28:00 GMT'}, 0),
+            1792567680)
+        self.assertEqual(
+            expires_at({'expires': 'Wed, 21 Oct 2026 07:28:00 GMT'}, 0),
+            1792567680)
+
+    def test_bad_max_age_falls_back_to_expires(self):
+        self.assertEqual(expires_at({'max-age': 'soon', 'expires':
+                                     'Wed, 21 Oct 2026 07:28:00 GMT'}, 0),
+                         1792567680)
+
+    def test_session_cookie(self):
+        self.assertIsNone(expires_at({}, 0))
+        self.assertIsNone(expires_at({'expires': 'never'}, 0))
+
+
+class MergeCookieTest(unittest.TestCase):
+    def test_updates_in_place_and_appends_new_names(self):
+        self.assertEqual(
+            merge_cookie('SID=1;NID=2;HSID=3;',
+                         parse_set_cookie('NID=20; path=/, APISID=4')),
+            'SID=1;NID=20;HSID=3;APISID=4')
+
+    def test_value_with_equal_sign(self):
+        self.assertEqual(merge_cookie('NID=188=a', [('NID', '188=b', {})]),
+                         'NID=188=b')
+
+
+if __name__ == '__main__':
+    unittest.main()
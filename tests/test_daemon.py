@@ -0,0 +1,86 @@
+import unittest
+from time import strptime
+
+from src.daemon import Schedule, parse_crontab, parse_field
+
+
+def at(text):
+    return strptime(text, '%Y-%m-%d %H:%M')
+
+
+class ParseFieldTest(unittest.TestCase):
+    def test_star(self):
+        self.assertEqual(parse_field('*', 0, 23), set(range(24)))
+
+    def test_step(self):
+        self.assertEqual(parse_field('*/15', 0, 59), {0, 15, 30, 45})
+
+    def test_list_and_range_with_step(self):
+        self.assertEqual(parse_field('1,10-14/2', 1, 31), {1, 10, 12, 14})
+
+    def test_sunday_as_seven(self):
+        self.assertEqual(parse_field('7', 0, 6), {0, 7})
+        self.assertEqual(parse_field('5-7', 0, 6), {0, 5, 6, 7})
+
+    def test_seven_outside_weekdays(self):
+        self.assertEqual(parse_field('7', 0, 23), {7})
+
+
+class ScheduleTest(unittest.TestCase):
+    def test_every_five_minutes(self):
+        schedule = Schedule('*/5 * * * *')
+        self.assertTrue(schedule.matches(at('2026-10-18 08:05')))
+        self.assertFalse(schedule.matches(at('2026-10-18 08:06')))
+
+    def test_hour_and_month(self):
+        schedule = Schedule('5 0 * 1,7 *')
+        self.assertTrue(schedule.matches(at('2026-07-03 00:05')))
+        self.assertFalse(schedule.matches(at('2026-07-03 01:05')))
+        self.assertFalse(schedule.matches(at('2026-08-03 00:05')))
+
+    def test_sunday_as_seven(self):
+        # 2026-10-18 is a sunday
+        self.assertTrue(Schedule('0 0 * * 7').matches(at('2026-10-18 00:00')))
+        self.assertTrue(Schedule('0 0 * * 0').matches(at('2026-10-18 00:00')))
+        self.assertFalse(
+            Schedule('0 0 * * 7').matches(at('2026-10-19 00:00')))
+
+    def test_weekday_from_sunday(self):
+        # 2026-10-19 is a monday
+        schedule = Schedule('0 0 * * 1')
+        self.assertTrue(schedule.matches(at('2026-10-19 00:00')))
+        self.assertFalse(schedule.matches(at('2026-10-18 00:00')))
+
+    def test_day_or_weekday_when_both_restricted(self):
+        # the 1st of the month or any monday
+        schedule = Schedule('0 0 1 * 1')
+        self.assertTrue(schedule.matches(at('2026-10-01 00:00')))
+        self.assertTrue(schedule.matches(at('2026-10-19 00:00')))
+        self.assertFalse(schedule.matches(at('2026-10-20 00:00')))
+
+    def test_day_and_weekday_when_one_is_star(self):
+        schedule = Schedule('0 0 1 * *')
+        self.assertTrue(schedule.matches(at('2026-10-01 00:00')))
+        self.assertFalse(schedule.matches(at('2026-10-19 00:00')))
+        schedule = Schedule('0 0 * * 1')
+        self.assertFalse(schedule.matches(at('2026-10-01 00:00')))
+
+
+class ParseCrontabTest(unittest.TestCase):
+    def test_module_commands(self):
+        jobs = parse_crontab('report', '\n'.join([
+            '# nightly report',
+            '',
+            '5 0 * * * cd /app && python -m src.report --from 2026-01-01',
+            '*/5 * * * * /usr/bin/backup.sh',
+            '0 0 * *',
+        ]))
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0].name, 'report')
+        self.assertEqual(jobs[0].module, 'src.report')
+        self.assertEqual(jobs[0].argv, ['--from', '2026-01-01'])
+        self.assertTrue(jobs[0].schedule.matches(at('2026-10-18 00:05')))
+
+
+if __name__ == '__main__':
+    unittest.main()
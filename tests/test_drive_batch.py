@@ -0,0 +1,83 @@
+import json
+import unittest
+
+from src.drive_batch import (DriveBatchError, boundary_of, build_batch_body,
+                             parse_batch_response, to_file)
+from src.key_pool import QuotaError
+
+CONTENT_TYPE = 'multipart/mixed; boundary="batch_abc"'
+
+
+def response_part(content_id, status, body):
+    return ('--batch_abc\r\n'
+            'Content-Type: application/http\r\n'
+            'Content-ID: <response-item-{}>\r\n'
+            '\r\n'
+            'HTTP/1.1 {}\r\n'
+            'Content-Type: application/json; charset=UTF-8\r\n'
+            '\r\n'
+            '{}\r\n'.format(content_id, status, body))
+
+
+class BuildBatchBodyTest(unittest.TestCase):
+    def test_one_part_per_id(self):
+        body = build_batch_body(['a/b', 'c'], 'k&y', 'xyz')
+        self.assertEqual(body.count('--xyz\r\n'), 2)
+        self.assertTrue(body.endswith('--xyz--\r\n'))
+        self.assertIn('Content-ID: <item-1>', body)
+        self.assertIn('GET /drive/v3/files/a%2Fb?fields=', body)
+        self.assertIn('&key=k%26y', body)
+
+
+class BoundaryOfTest(unittest.TestCase):
+    def test_quoted_boundary(self):
+        self.assertEqual(boundary_of(CONTENT_TYPE), 'batch_abc')
+
+    def test_missing_boundary(self):
+        with self.assertRaises(DriveBatchError):
+            boundary_of('multipart/mixed')
+
+
+class ParseBatchResponseTest(unittest.TestCase):
+    def test_parts_by_index(self):
+        text = (response_part(1, '404 Not Found', '{}') +
+                response_part(0, '200 OK', '{"name": "a", "size": "3"}') +
+                '--batch_abc--\r\n')
+        self.assertEqual(parse_batch_response(CONTENT_TYPE, text), {
+            0: (200, '{"name": "a", "size": "3"}'),
+            1: (404, '{}')})
+
+    def test_malformed_part_only_fails_itself(self):
+        text = ('--batch_abc\r\nContent-Type: application/http\r\n\r\n'
+                'HTTP/1.1 200 OK\r\n\r\n{}\r\n' +
+                response_part(1, '200 OK', '{}') + '--batch_abc--\r\n')
+        self.assertEqual(parse_batch_response(CONTENT_TYPE, text),
+                         {1: (200, '{}')})
+
+    def test_bare_newlines(self):
+        text = ('--batch_abc\nContent-ID: <response-item-0>\n\n'
+                'HTTP/1.1 200 OK\n\n{}\n--batch_abc--\n')
+        self.assertEqual(parse_batch_response(CONTENT_TYPE, text),
+                         {0: (200, '{}')})
+
+
+class ToFileTest(unittest.TestCase):
+    def test_file(self):
+        self.assertEqual(to_file(200, '{"name": "a.mp4", "size": "42"}'),
+                         {'name': 'a.mp4', 'size': 42})
+
+    def test_quota_error(self):
+        body = json.dumps({'error': {'errors': [
+            {'reason': 'userRateLimitExceeded'}]}})
+        with self.assertRaises(QuotaError):
+            to_file(403, body)
+        with self.assertRaises(QuotaError):
+            to_file(429, '')
+
+    def test_other_error(self):
+        with self.assertRaises(DriveBatchError):
+            to_file(404, '{}')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.schema import UniqueConstraint
+
+from src.indexes import delete_duplicates, table_changes
+from src.models import ReportEarning
+
+TABLE = ReportEarning.__table__
+
+
+class DuplicatesTest(unittest.TestCase):
+    def setUp(self):
+        # report_earning as it was before its date key
+        self.engine = create_engine('sqlite://')
+        self.engine.execute('CREATE TABLE report_earning '
+                            '(id INTEGER PRIMARY KEY, date INTEGER)')
+        self.engine.execute('INSERT INTO report_earning (id, date) VALUES '
+                            '(1, 20260101), (2, 20260101), (3, 20260102), '
+                            '(4, 20260103), (5, 20260103), (6, 20260103)')
+
+    def date_key(self):
+        return next(constraint for constraint in TABLE.constraints
+                    if isinstance(constraint, UniqueConstraint))
+
+    def changes(self, dedupe):
+        return [(what, ddl) for (what, ddl, _) in table_changes(
+            self.engine, inspect(self.engine), TABLE, dedupe)
+            if not what.startswith('column ')]
+
+    def test_keeps_the_oldest_row(self):
+        self.engine.execute(delete_duplicates(self.date_key()))
+        self.assertEqual(
+            self.engine.execute(
+                'SELECT id FROM report_earning ORDER BY id').fetchall(),
+            [(1,), (3,), (4,)])
+
+    def test_opt_in(self):
+        changes = self.changes(dedupe=False)
+        self.assertEqual(changes[0], ('unique key (date)', None))
+        self.assertFalse(any(what.startswith('duplicates')
+                             for (what, _) in changes))
+
+    def test_deletes_then_adds_the_key(self):
+        changes = self.changes(dedupe=True)
+        self.assertEqual([what for (what, _) in changes[:2]],
+                         ['duplicates of (date)', 'unique key (date)'])
+        self.assertIn('min(report_earning.id)', changes[0][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+from time import time
+
+from src import lease
+from src.lease import Lease, LeaseLost
+
+
+class ProgressTest(unittest.TestCase):
+    def tearDown(self):
+        lease.local.lease = None
+
+    def test_stops_once_expired(self):
+        lease.local.lease = Lease('test', ttl=120)
+        lease.local.lease.renewed_at = time() - 121
+        with self.assertRaises(LeaseLost):
+            lease.progress('chunk')
+
+    def test_stops_once_lost(self):
+        lease.local.lease = Lease('test', ttl=120)
+        lease.local.lease.renewed_at = time()
+        lease.local.lease.lost = True
+        with self.assertRaises(LeaseLost):
+            lease.progress('chunk')
+
+    def test_records_progress(self):
+        lease.local.lease = Lease('test', ttl=120)
+        lease.local.lease.renewed_at = time()
+        lease.progress('chunk')
+        self.assertEqual(lease.local.lease.progress, 'chunk')
+
+
+if __name__ == '__main__':
+    unittest.main()
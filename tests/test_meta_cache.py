@@ -0,0 +1,41 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from src.meta_cache import MetaCache
+
+FILE = {'name': 'a.mp4', 'size': 42}
+
+
+class MetaCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'cache.db')
+        self.cache = MetaCache(self.path, timeout=0.01)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        self.cache.put_many({'a': FILE})
+        self.assertEqual(self.cache.get_many(['a', 'b']), {'a': FILE})
+
+    def test_locked_by_another_worker(self):
+        self.cache.put_many({'a': FILE})
+        other = sqlite3.connect(self.path, isolation_level=None)
+        other.execute('BEGIN EXCLUSIVE')
+        try:
+            # a miss and a skipped write instead of an error
+            self.assertEqual(self.cache.get_many(['a']), {})
+            self.cache.put_many({'b': FILE})
+        finally:
+            other.execute('ROLLBACK')
+            other.close()
+        self.assertEqual(self.cache.get_many(['a', 'b']), {'a': FILE})
+
+
+if __name__ == '__main__':
+    unittest.main()
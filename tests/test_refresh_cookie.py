@@ -0,0 +1,31 @@
+import unittest
+
+from src.models import Config
+from src.refresh_cookie import count_due, due_cookies
+from tests.sqlite import SqliteTestCase
+
+
+class DueCookiesTest(SqliteTestCase):
+    tables = (Config.__table__,)
+
+    def add(self, group, status, expires, key='GMAIL_COOKIE'):
+        with self.engine.begin() as conn:
+            conn.execute(Config.__table__.insert(), {
+                'key': key, 'group': group, 'value': 'SID=1',
+                'expired_to': 0, 'status': status, 'expires': expires})
+
+    def test_active_and_due_only(self):
+        self.add('new@example.com', Config.ACTIVE_STATUS, None)
+        self.add('due@example.com', Config.ACTIVE_STATUS, 50)
+        self.add('later@example.com', Config.ACTIVE_STATUS, 150)
+        self.add('invalid@example.com', Config.INACTIVE_STATUS, 50)
+        self.add('other@example.com', Config.ACTIVE_STATUS, 50,
+                 key='GDRIVE_API_KEY')
+        self.assertEqual(
+            sorted(cookie.group for cookie in due_cookies(100, 10)),
+            ['due@example.com', 'new@example.com'])
+        self.assertEqual(count_due(100), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
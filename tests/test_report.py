@@ -0,0 +1,71 @@
+import unittest
+from datetime import date
+from collections import namedtuple
+from unittest import mock
+
+from src import report
+from src.report import (GlobalRollup, SourceRollup, UserRollup,
+                        build_reports, timestamp_ranges)
+
+Row = namedtuple('Row', ['transaction_type', 'balance', 'user_id',
+                         'source_id'])
+DATES = [20261017, 20261018]
+
+
+def totals_of(reports, *columns):
+    return [tuple(row[column] for column in columns) for row in reports]
+
+
+class TimestampRangesTest(unittest.TestCase):
+    def test_days(self):
+        (begin, end, dates) = timestamp_ranges(date(2026, 10, 30),
+                                               date(2026, 11, 1))
+        self.assertEqual(dates, [20261030, 20261031, 20261101])
+        self.assertEqual(end - begin, 3 * report.DAY)
+
+
+class BuildReportsTest(unittest.TestCase):
+    def test_grouped_rows(self):
+        reports = build_reports(DATES, [(1, 'VIEW', 3, 30),
+                                        (1, 'EXPORT_DRIVE', 2, None)])
+        self.assertEqual(
+            totals_of(reports, 'date', 'total_req', 'total_earn',
+                      'total_view_earn', 'total_export'),
+            [(20261017, 0, 0, 0, 0), (20261018, 5, 30, 30, 2)])
+
+
+class RollupTest(unittest.TestCase):
+    def fold(self, rollup):
+        for (day, row) in [
+                (0, Row('VIEW', -10, 1, 'a')),
+                (0, Row('VIEW', -5, 2, 'b')),
+                (0, Row('UPLOAD_PHOTO', -1, 1, None)),
+                (0, Row('EXPORT_DRIVE', None, 1, 'a'))]:
+            rollup.add(day, row)
+        return rollup
+
+    def test_global_has_every_day(self):
+        reports = self.fold(GlobalRollup(DATES)).reports()
+        self.assertEqual(
+            totals_of(reports, 'date', 'total_req', 'total_earn',
+                      'total_view', 'total_upload_earn', 'total_export'),
+            [(20261017, 4, 16, 2, 1, 1), (20261018, 0, 0, 0, 0, 0)])
+
+    def test_per_user(self):
+        reports = self.fold(UserRollup(DATES)).reports()
+        self.assertEqual(
+            sorted(totals_of(reports, 'date', 'user_id', 'total_req',
+                             'total_earn')),
+            [(20261017, 1, 3, 11), (20261017, 2, 1, 5)])
+
+    def test_top_sources(self):
+        with mock.patch.object(report, 'REPORT_TOP_SOURCES', 1):
+            reports = self.fold(SourceRollup(DATES)).reports()
+        self.assertEqual(
+            totals_of(reports, 'date', 'rank', 'source_id', 'total_req',
+                      'total_earn'),
+            [(20261017, 1, 'a', 2, 10)])
+
+
+if __name__ == '__main__':
+    unittest.main()
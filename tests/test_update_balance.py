@@ -0,0 +1,47 @@
+import unittest
+from unittest import mock
+
+from src import update_balance
+from src.update_balance import split_shards
+
+
+class SplitShardsTest(unittest.TestCase):
+    def test_users_by_modulo(self):
+        balances = [(1, -5, 10), (2, -1, 11), (5, -3, 12), (8, None, 13)]
+        self.assertEqual(split_shards(balances, 4), [
+            [(8, None, 13)], [(1, -5, 10), (5, -3, 12)], [(2, -1, 11)]])
+
+    def test_one_shard(self):
+        self.assertEqual(split_shards([(3, -1, 1)], 1), [[(3, -1, 1)]])
+
+
+class ShardPoolTest(unittest.TestCase):
+    def test_workers_are_spawned(self):
+        # a forked worker would inherit the locks held by the lease
+        # heartbeat and the other daemon jobs
+        pool = update_balance.shard_pool(2)
+        try:
+            self.assertEqual(pool._mp_context.get_start_method(), 'spawn')
+        finally:
+            pool.shutdown()
+
+
+class ExecuteTest(unittest.TestCase):
+    @mock.patch.object(update_balance, 'execute_recent')
+    @mock.patch.object(update_balance, 'execute_watermark')
+    def test_watermark_by_default(self, watermark, recent):
+        update_balance.execute(2)
+        watermark.assert_called_once_with(2)
+        recent.assert_not_called()
+
+    @mock.patch.object(update_balance, 'UPDATE_BALANCE_MODE', 'recent')
+    @mock.patch.object(update_balance, 'execute_recent')
+    @mock.patch.object(update_balance, 'execute_watermark')
+    def test_recent_on_request(self, watermark, recent):
+        update_balance.execute()
+        recent.assert_called_once_with()
+        watermark.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+
+from sqlalchemy.dialects import mysql
+
+from src.models import Stream
+from src.update_drive_info import claim_statement
+
+
+class ClaimStatementTest(unittest.TestCase):
+    def test_ordered_like_the_lease_index(self):
+        # an order the index cannot serve sorts the whole backlog per claim
+        index = next(index for index in Stream.__table__.indexes
+                     if index.name == 'ix_streams_updated_meta_'
+                                      'meta_lease_until')
+        columns = ', '.join('streams.{}'.format(column.name)
+                            for column in index.columns)
+        sql = str(claim_statement('worker', 0, 100).compile(
+            dialect=mysql.dialect()))
+        self.assertTrue(sql.endswith(
+            'ORDER BY {}, streams.id LIMIT 100'.format(columns)), sql)
+
+    def test_plain_update_elsewhere(self):
+        sql = str(claim_statement('worker', 0, 100).compile())
+        self.assertNotIn('ORDER BY', sql)
+
+
+if __name__ == '__main__':
+    unittest.main()
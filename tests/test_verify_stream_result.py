@@ -0,0 +1,28 @@
+import unittest
+from collections import namedtuple
+
+from src.probe import ProbeDeadlineError
+from src.verify_stream_result import classify
+
+Stream = namedtuple('Stream', ['id', 'source_id'])
+
+
+class ClassifyTest(unittest.TestCase):
+    def test_outcomes(self):
+        error = IOError('reset')
+        (active, dead, unresolved, failures) = classify([
+            (Stream(1, 'a'), 200, None),
+            (Stream(2, 'b'), 302, None),
+            (Stream(3, 'c'), 404, None),
+            (Stream(4, 'd'), 403, None),
+            (Stream(5, 'e'), None, error),
+            (Stream(6, 'f'), None, ProbeDeadlineError()),
+        ])
+        self.assertEqual(active, [1, 2])
+        self.assertEqual(dead, [3])
+        self.assertEqual(unresolved, [4, 5])
+        self.assertEqual(failures, [(5, error)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+from time import time
+from unittest import mock
+
+from src import update_balance, watermark
+from src.models import BalanceLog, UserBalance2
+from tests.sqlite import SqliteTestCase
+
+# transaction_timestamp is in microseconds
+NOW = int(time()) * 1000000
+SETTLED = NOW - (watermark.WATERMARK_SETTLE_SECONDS + 60) * 1000000
+
+
+class LedgerTest(SqliteTestCase):
+    tables = (BalanceLog.__table__, UserBalance2.__table__)
+
+    def insert(self, ledger_id, user_id, balance, stamp):
+        with self.engine.begin() as conn:
+            conn.execute(BalanceLog.__table__.insert(), {
+                'id': ledger_id, 'user_id': user_id, 'balance': balance,
+                'transaction_timestamp': stamp})
+
+
+class SettledLedgerIdTest(LedgerTest):
+    def test_stops_before_recent_rows(self):
+        self.insert(1, 1, -1, SETTLED)
+        self.insert(2, 1, -1, SETTLED)
+        self.insert(3, 1, -1, NOW)
+        self.assertEqual(watermark.settled_ledger_id(0, 3), 2)
+        self.assertEqual(watermark.settled_ledger_id(2, 3), 2)
+
+    def test_empty_range(self):
+        self.assertEqual(watermark.settled_ledger_id(5, 10), 5)
+
+
+class OutOfOrderCommitTest(LedgerTest):
+    def test_late_commit_is_folded(self):
+        state = {'watermark': 0, 'folded': 0}
+
+        def set_watermark(name, last_id):
+            state['watermark'] = last_id
+
+        def update_user_balances(balances):
+            state['folded'] += sum(balance for (_, balance, _) in balances)
+
+        patches = [
+            mock.patch.object(update_balance, 'lock_watermark',
+                              lambda name: state['watermark']),
+            mock.patch.object(update_balance, 'set_watermark',
+                              set_watermark),
+            mock.patch.object(update_balance, 'update_user_balances',
+                              update_user_balances),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.insert(1, 1, -1, SETTLED)
+        self.insert(2, 2, -2, SETTLED)
+        # id 4 is taken by a transaction that commits after the one of 5
+        self.insert(5, 1, -5, NOW)
+        self.assertEqual(update_balance.balance_batch(100), 2)
+        self.assertEqual(state, {'watermark': 2, 'folded': -3})
+
+        self.insert(4, 2, -4, NOW)
+        later = time() + watermark.WATERMARK_SETTLE_SECONDS + 1
+        with mock.patch.object(watermark, 'time', lambda: later):
+            self.assertEqual(update_balance.balance_batch(100), 3)
+        self.assertEqual(state, {'watermark': 5, 'folded': -12})
+
+
+if __name__ == '__main__':
+    unittest.main()